@@ -0,0 +1,207 @@
+"""
+Time the page parsers against the pages in data/.
+
+    python benchmark.py                        # run and print a report
+    python benchmark.py --save baseline.json   # ...and keep the results
+    python benchmark.py --compare baseline.json
+
+With --compare, any case slower than the baseline by more than --threshold
+is flagged and the exit status is 1.
+"""
+import argparse
+import json
+import multiprocessing
+import re
+import resource
+import sys
+import time
+
+from company_index import CompanyIndex
+from company_name_change_page import CompanyNameChangePage
+from company_page import CompanyPage
+from main_index import MainIndex
+
+
+def fixture(filename):
+    with open('data/' + filename) as f:
+        return f.read()
+
+
+def scaled_page(html, row_pattern, rows):
+    """
+    Copy of a page with the rows matching `row_pattern` repeated until there
+    are `rows` of them, for seeing how a parser copes with a much bigger
+    page. Works on the raw bytes so the page keeps its own character set.
+    """
+    matches = list(re.finditer(row_pattern, html, re.DOTALL))
+    template = [m.group(0) for m in matches]
+    extra = ''.join(
+        template[n % len(template)] for n in range(rows - len(template))
+    )
+    end = matches[-1].end()
+    return html[:end] + extra + html[end:]
+
+
+def main_index_links():
+    html = fixture('ListofBusinessOperators.aspx')
+    return lambda: list(MainIndex(html).links)
+
+
+def company_index_links(rows=None):
+    html = fixture('COMPANYPROFILE03.aspx')
+    if rows:
+        html = scaled_page(html, r'<tr class="rg(?:Alt)?Row"[^>]*>(?:(?!<tr).)*?</tr>', rows)
+    return lambda: list(CompanyIndex(html, title='', parents=[]).links)
+
+
+def company_page_data(executives=None, backend='lxml', sections=None):
+    html = fixture('company.html')
+    if executives:
+        html = scaled_page(
+            html, r'<tr><td>\d+\.</td>(?:<td>[^<]*</td>){3}</tr>', executives
+        )
+    return lambda: CompanyPage(html, backend=backend, sections=sections).data
+
+
+def name_change_page_old_names():
+    html = fixture('namechange.html')
+    return lambda: CompanyNameChangePage(html).old_names
+
+
+CASES = [
+    ('MainIndex.links', main_index_links, {}),
+    ('CompanyIndex.links', company_index_links, {}),
+    ('CompanyIndex.links x10000 rows', company_index_links, {'rows': 10000}),
+    ('CompanyPage.data', company_page_data, {}),
+    ('CompanyPage.data (pyquery)', company_page_data, {'backend': 'pyquery'}),
+    ('CompanyPage.data x1000 executives', company_page_data, {'executives': 1000}),
+    ('CompanyPage.data x1000 (2 sections)', company_page_data, {
+        'executives': 1000, 'sections': {'basic', 'licenses'},
+    }),
+    ('CompanyNameChangePage.old_names', name_change_page_old_names, {}),
+]
+
+
+def run_case(name, min_time=1.0):
+    """
+    Time one case, calling it repeatedly for at least `min_time` seconds.
+    Meant to be run in a fresh process, so that peak RSS is its own.
+    """
+    for case_name, setup, kwargs in CASES:
+        if case_name == name:
+            break
+    else:
+        raise KeyError(name)
+
+    parse = setup(**kwargs)
+    timings = []
+    started = time.time()
+    while not timings or time.time() - started < min_time:
+        start = time.time()
+        parse()
+        timings.append(time.time() - start)
+
+    timings.sort()
+    median = timings[len(timings) // 2]
+    return {
+        'calls': len(timings),
+        'latency_ms': median * 1000,
+        'min_ms': timings[0] * 1000,
+        'pages_per_sec': 1 / median if median else float('inf'),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+
+def run(names, min_time=1.0):
+    results = {}
+    for name in names:
+        pool = multiprocessing.Pool(1)
+        try:
+            results[name] = pool.apply(run_case, (name, min_time))
+        finally:
+            pool.terminate()
+    return results
+
+
+def regressions(results, baseline, threshold):
+    """Cases whose median latency is more than `threshold` worse than baseline"""
+    slower = {}
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result['latency_ms'] / baseline[name]['latency_ms']
+            if ratio > 1 + threshold:
+                slower[name] = ratio
+    return slower
+
+
+def report(results, baseline=None, slower=()):
+    lines = ['%-36s %10s %12s %10s %10s' % (
+        'case', 'median ms', 'pages/sec', 'peak MB', 'vs base')]
+    for name, _, _ in CASES:
+        if name not in results:
+            continue
+        result = results[name]
+        change = ''
+        if baseline and name in baseline:
+            change = '%+.0f%%' % (
+                100 * (result['latency_ms'] / baseline[name]['latency_ms'] - 1))
+            if name in slower:
+                change += ' !!'
+        lines.append('%-36s %10.2f %12.1f %10.1f %10s' % (
+            name,
+            result['latency_ms'],
+            result['pages_per_sec'],
+            result['peak_rss_mb'],
+            change,
+        ))
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        'cases', nargs='*', metavar='case',
+        help='cases to run (default: all); any case whose name contains this',
+    )
+    parser.add_argument(
+        '--min-time', type=float, default=1.0,
+        help='seconds to spend timing each case',
+    )
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--compare', help='baseline results to compare against')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='fraction slower than baseline that counts as a regression',
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    names = [
+        name for name, _, _ in CASES
+        if not args.cases or any(case in name for case in args.cases)
+    ]
+    results = run(names, args.min_time)
+
+    baseline = None
+    slower = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        slower = regressions(results, baseline, args.threshold)
+
+    print report(results, baseline, slower)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if slower:
+        print
+        print 'Slower than baseline: %s' % ', '.join(sorted(slower))
+        sys.exit(1)
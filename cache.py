@@ -0,0 +1,173 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib
+from urlparse import parse_qsl, urlsplit, urlunsplit
+
+
+def normalize_url(url):
+    """
+    Canonical form of a URL for use as a cache key.
+
+    Scheme and host are lowercased, default ports and fragments dropped and
+    query parameters sorted, so trivially different spellings share a key.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    default_port = {'http': ':80', 'https': ':443'}.get(scheme)
+    if default_port and netloc.endswith(default_port):
+        netloc = netloc[:-len(default_port)]
+    query = urllib.urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class CacheEntry(object):
+    def __init__(self, cache, url, digest, etag, last_modified):
+        self._cache = cache
+        self.url = url
+        self.digest = digest
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def validators(self):
+        """Headers for a conditional request revalidating this entry"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    @property
+    def body(self):
+        with open(self._cache.body_path(self.digest), 'rb') as f:
+            return f.read()
+
+
+class ResponseCache(object):
+    """
+    On-disk cache of response bodies and their validators.
+
+    Bodies are stored once per distinct content under their SHA-1, and an
+    SQLite index maps each normalized URL to a body and its ETag and
+    Last-Modified headers. When the bodies outgrow `max_size` bytes the
+    least recently used entries are evicted.
+    """
+    def __init__(self, root, max_size=500 * 1024 * 1024, clock=time.time):
+        self.root = root
+        self.max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(os.path.join(root, 'bodies')):
+            os.makedirs(os.path.join(root, 'bodies'))
+
+        self._db = sqlite3.connect(
+            os.path.join(root, 'index.sqlite'),
+            check_same_thread=False,
+        )
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                accessed REAL NOT NULL
+            )
+        ''')
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)'
+        )
+        self._db.commit()
+
+        self._size = self._db.execute('''
+            SELECT COALESCE(SUM(size), 0) FROM
+            (SELECT DISTINCT digest, size FROM responses)
+        ''').fetchone()[0]
+
+    def body_path(self, digest):
+        return os.path.join(self.root, 'bodies', digest[:2], digest)
+
+    def get(self, url):
+        key = normalize_url(url)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT digest, etag, last_modified FROM responses WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                'UPDATE responses SET accessed = ? WHERE key = ?',
+                (self._clock(), key)
+            )
+            self._db.commit()
+        digest, etag, last_modified = row
+        return CacheEntry(self, url, digest, etag, last_modified)
+
+    def put(self, url, body, etag=None, last_modified=None):
+        key = normalize_url(url)
+        digest = hashlib.sha1(body).hexdigest()
+
+        with self._lock:
+            previous = self._db.execute(
+                'SELECT digest, size FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if not self._in_use(digest):
+                self._write(self.body_path(digest), body)
+                self._size += len(body)
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (key, digest, len(body), etag, last_modified, self._clock())
+            )
+            if previous and previous[0] != digest:
+                self._release(*previous)
+            self._evict()
+            self._db.commit()
+
+    @staticmethod
+    def _write(path, body):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.rename(tmp_path, path)
+
+    def _in_use(self, digest):
+        return self._db.execute(
+            'SELECT 1 FROM responses WHERE digest = ? LIMIT 1', (digest,)
+        ).fetchone() is not None
+
+    def _release(self, digest, size):
+        """Delete a body once no entry refers to it any more"""
+        if not self._in_use(digest):
+            os.remove(self.body_path(digest))
+            self._size -= size
+
+    @property
+    def size(self):
+        """Bytes on disk, counting each distinct body once"""
+        return self._size
+
+    def _evict(self):
+        while self._size > self.max_size:
+            key, digest, size = self._db.execute(
+                'SELECT key, digest, size FROM responses ORDER BY accessed LIMIT 1'
+            ).fetchone()
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._release(digest, size)
+
+    def close(self):
+        self._db.close()
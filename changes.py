@@ -0,0 +1,73 @@
+from collections import OrderedDict
+
+
+# How to tell entries in each list apart from one run to the next. Entries
+# with the same key are compared, and reported as modified if they differ.
+SECTION_KEYS = {
+    'licenses': ('type', 'number', 'business'),
+    'major_shareholders': ('name',),
+    'executives': ('name',),
+    'fund_managers': ('name', 'type'),
+    'head_of_compliance': ('name',),
+    'old_names': ('name', 'until'),
+}
+
+
+def group_by_key(entries, key):
+    groups = OrderedDict()
+    for entry in entries or []:
+        groups.setdefault(tuple(entry.get(k) for k in key), []).append(entry)
+    return groups
+
+
+def diff_section(old, new, key):
+    """
+    Entries added to, removed from and modified in a list, matched up by the
+    fields in `key`. Empty if the lists hold the same entries.
+    """
+    old_groups = group_by_key(old, key)
+    new_groups = group_by_key(new, key)
+
+    added, removed, modified = [], [], []
+    for k in list(new_groups) + [k for k in old_groups if k not in new_groups]:
+        old_entries = old_groups.get(k, [])
+        new_entries = new_groups.get(k, [])
+        for old_entry, new_entry in zip(old_entries, new_entries):
+            if old_entry != new_entry:
+                modified.append({'old': old_entry, 'new': new_entry})
+        added.extend(new_entries[len(old_entries):])
+        removed.extend(old_entries[len(new_entries):])
+
+    diff = {}
+    for name, entries in [('added', added), ('removed', removed), ('modified', modified)]:
+        if entries:
+            diff[name] = entries
+    return diff
+
+
+def diff_records(old, new):
+    """
+    What changed between two records of a company, section by section.
+
+    Each list section that changed gives its added, removed and modified
+    entries; other fields that changed are under 'fields' with their old and
+    new values. Either record can be None, for a company that's new or gone.
+    Empty if nothing changed.
+    """
+    old = old or {}
+    new = new or {}
+    changes = {}
+
+    for section, key in SECTION_KEYS.items():
+        diff = diff_section(old.get(section), new.get(section), key)
+        if diff:
+            changes[section] = diff
+
+    fields = {}
+    for field in set(old) | set(new):
+        if field not in SECTION_KEYS and old.get(field) != new.get(field):
+            fields[field] = {'old': old.get(field), 'new': new.get(field)}
+    if fields:
+        changes['fields'] = fields
+
+    return changes
@@ -0,0 +1,99 @@
+import json
+import sqlite3
+
+
+class Checkpoint(object):
+    """
+    Durable progress through a run, so that a crashed run can pick up where
+    it left off.
+
+    It holds the company indexes found on the main index (the frontier),
+    which of them are finished, and the `cno` of every company already
+    emitted. Once the run completes, `finish` wipes it ready for a fresh
+    start next time.
+
+    Without `autocommit`, progress is only saved by `commit`, which should
+    be called once the records emitted so far are safely written out. It
+    can save how far into each output file they reach, too.
+    """
+    def __init__(self, path, autocommit=True):
+        self.autocommit = autocommit
+        self._db = sqlite3.connect(path)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS indexes (
+                position INTEGER PRIMARY KEY,
+                link TEXT NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS companies (
+                cno TEXT PRIMARY KEY
+            );
+            CREATE TABLE IF NOT EXISTS outputs (
+                name TEXT PRIMARY KEY,
+                offset INTEGER NOT NULL
+            );
+        ''')
+        self._db.commit()
+
+    def start(self, links):
+        """Record the frontier of a new run"""
+        with self._db:
+            self._db.execute('DELETE FROM outputs')
+            self._db.executemany(
+                'INSERT INTO indexes (position, link) VALUES (?, ?)',
+                ((position, json.dumps(link)) for position, link in enumerate(links))
+            )
+        return self.pending_indexes()
+
+    def indexes(self):
+        """Every company index in the run, as (position, link) pairs"""
+        return [
+            (position, json.loads(link))
+            for position, link in self._db.execute(
+                'SELECT position, link FROM indexes ORDER BY position'
+            )
+        ]
+
+    def pending_indexes(self):
+        """Company indexes not yet finished, as (position, link) pairs"""
+        return [
+            (position, json.loads(link))
+            for position, link in self._db.execute(
+                'SELECT position, link FROM indexes WHERE NOT done ORDER BY position'
+            )
+        ]
+
+    def complete_index(self, position):
+        self._db.execute(
+            'UPDATE indexes SET done = 1 WHERE position = ?', (position,)
+        )
+        if self.autocommit:
+            self._db.commit()
+
+    def completed_companies(self):
+        return set(cno for (cno,) in self._db.execute('SELECT cno FROM companies'))
+
+    def complete_company(self, cno):
+        self._db.execute('INSERT OR IGNORE INTO companies VALUES (?)', (cno,))
+        if self.autocommit:
+            self._db.commit()
+
+    def output_offsets(self):
+        """How far into each output file the saved progress reaches, by name"""
+        return dict(self._db.execute('SELECT name, offset FROM outputs'))
+
+    def commit(self, output_offsets=None):
+        self._db.executemany(
+            'INSERT OR REPLACE INTO outputs VALUES (?, ?)',
+            (output_offsets or {}).items()
+        )
+        self._db.commit()
+
+    def finish(self):
+        with self._db:
+            self._db.execute('DELETE FROM indexes')
+            self._db.execute('DELETE FROM companies')
+            self._db.execute('DELETE FROM outputs')
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,186 @@
+"""
+Export records as one Parquet file per sub-table of the company data.
+
+    python columnar.py records.jsonl.gz columnar/
+
+Each row is keyed by the company's `cno` and the record's sample date.
+String columns whose values repeat a lot are dictionary-encoded.
+
+Needs the optional pyarrow package.
+"""
+import argparse
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from output import read_records
+from utils import company_id
+
+
+# Column names and types for each sub-table, after the key columns.
+# 'category' columns are dictionary-encoded strings.
+TABLES = [
+    ('licenses', [
+        ('type', 'category'),
+        ('number', 'string'),
+        ('effective_date', 'string'),
+        ('business', 'category'),
+        ('start_date', 'string'),
+        ('remark', 'category'),
+    ]),
+    ('major_shareholders', [
+        ('name', 'string'),
+        ('percentage', 'float'),
+    ]),
+    ('executives', [
+        ('name', 'string'),
+        ('position', 'category'),
+        ('nationality', 'category'),
+    ]),
+    ('fund_managers', [
+        ('name', 'string'),
+        ('type', 'category'),
+        ('approval_date', 'string'),
+        ('appointed_date', 'string'),
+        ('training_deadline', 'string'),
+    ]),
+    ('head_of_compliance', [
+        ('name', 'string'),
+        ('start_date', 'string'),
+    ]),
+]
+
+KEY_COLUMNS = [
+    ('company_id', 'string'),
+    ('sample_date', 'string'),
+]
+
+
+def arrow_type(kind):
+    return {
+        'string': pyarrow.string(),
+        'category': pyarrow.dictionary(pyarrow.int32(), pyarrow.string()),
+        'float': pyarrow.float64(),
+    }[kind]
+
+
+def arrow_array(values, kind):
+    if kind == 'category':
+        return pyarrow.array(values, type=pyarrow.string()).dictionary_encode()
+    return pyarrow.array(values, type=arrow_type(kind))
+
+
+class TableWriter(object):
+    """Buffers one sub-table's rows and writes them out as row groups"""
+
+    def __init__(self, path, columns, row_group_size):
+        self.columns = KEY_COLUMNS + columns
+        self.row_group_size = row_group_size
+        self.schema = pyarrow.schema([
+            pyarrow.field(name, arrow_type(kind)) for name, kind in self.columns
+        ])
+        self._writer = pyarrow.parquet.ParquetWriter(
+            path, self.schema, use_dictionary=True
+        )
+        self._clear()
+
+    def _clear(self):
+        self._rows = 0
+        self._values = dict((name, []) for name, _ in self.columns)
+
+    def append(self, row):
+        for name, _ in self.columns:
+            self._values[name].append(row.get(name))
+        self._rows += 1
+        if self._rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            self._writer.write_table(pyarrow.Table.from_arrays(
+                [arrow_array(self._values[name], kind) for name, kind in self.columns],
+                schema=self.schema,
+            ))
+            self._clear()
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+class ColumnarWriter(object):
+    """
+    Writes the sub-tables of each record (licenses, executives and so on)
+    to `<directory>/<table>.parquet`, one row per entry.
+
+    Files are written as `<table>.parquet.partial` and renamed into place
+    when the writer is closed.
+    """
+    def __init__(self, directory, row_group_size=10000):
+        if pyarrow is None:
+            raise ValueError('columnar export needs the pyarrow package')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.paths = {}
+        self._tables = {}
+        for table, columns in TABLES:
+            self.paths[table] = os.path.join(directory, table + '.parquet')
+            self._tables[table] = TableWriter(
+                self.paths[table] + '.partial', columns, row_group_size
+            )
+
+    def write(self, record):
+        key = {
+            'company_id': company_id(record['source_url']),
+            'sample_date': record['sample_date'],
+        }
+        for table, _ in TABLES:
+            for entry in record.get(table) or []:
+                row = dict(entry)
+                row.update(key)
+                self._tables[table].append(row)
+
+    def close(self):
+        for table, writer in self._tables.items():
+            writer.close()
+            os.rename(self.paths[table] + '.partial', self.paths[table])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            for writer in self._tables.values():
+                writer.close()
+
+
+def export(path, directory, row_group_size=10000):
+    """Export the records in the file at `path` to `directory`"""
+    with ColumnarWriter(directory, row_group_size) as writer:
+        for record in read_records(path):
+            writer.write(record)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('records', help='file of records written by the scraper')
+    parser.add_argument('directory', help='where to write the Parquet files')
+    parser.add_argument(
+        '--row-group-size', type=int, default=10000,
+        help='rows to write to each Parquet row group',
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    export(args.records, args.directory, args.row_group_size)
@@ -1,20 +1,195 @@
 import re
+from HTMLParser import HTMLParser
 
+from cssselect import GenericTranslator
+from lxml import etree
 from pyquery import PyQuery as pq
 
-from utils import hungry_merge, iso_date, strip_whitespace
+from utils import element_text, hungry_merge, iso_date, strip_whitespace
+
+
+NAME_CHANGE_LINK = re.compile(
+    r'''<a\s[^>]*href=['"]?([^'"\s>]*showcomphist\.php[^'"\s>]*)''', re.IGNORECASE
+)
+
+
+def find_name_change_link(content):
+    """
+    Where the company page's "History of Name Change" link goes, if it has
+    one. Looks straight at the raw page, without parsing it, so entities
+    in the link are decoded here.
+    """
+    match = NAME_CHANGE_LINK.search(content)
+    if match:
+        link = HTMLParser().unescape(match.group(1))
+        if isinstance(link, unicode):
+            link = link.encode('utf-8')
+        return link
+
+
+def css_to_xpath(selector):
+    """Compile a CSS selector to XPath, as PyQuery does through cssselect"""
+    return etree.XPath(GenericTranslator().css_to_xpath(selector))
+
+
+class PyQueryRow(object):
+    """A table row, read through PyQuery, with whitespace stripped from text"""
+
+    def __init__(self, row):
+        self._row = row
+
+    @property
+    def classes(self):
+        return self._row.attr['class']
+
+    @property
+    def text(self):
+        return strip_whitespace(self._row.text())
+
+    @property
+    def cells(self):
+        return [strip_whitespace(cell.text()) for cell in self._row.items('td')]
+
+    @property
+    def links(self):
+        return self._row.find('a')
+
+
+class LxmlRow(object):
+    """A table row, read straight off the lxml tree, with whitespace stripped"""
+
+    CELLS = css_to_xpath('td')
+    LINKS = etree.XPath('descendant::a')
+
+    def __init__(self, row):
+        self._row = row
+
+    @property
+    def classes(self):
+        return self._row.get('class')
+
+    @property
+    def text(self):
+        return strip_whitespace(element_text(self._row))
+
+    @property
+    def cells(self):
+        return [strip_whitespace(element_text(cell)) for cell in self.CELLS(self._row)]
+
+    @property
+    def links(self):
+        return self.LINKS(self._row)
+
+
+class PyQueryBackend(object):
+    def __init__(self, content):
+        self._content = pq(content)
+
+    @property
+    def title(self):
+        return strip_whitespace(self._content('.menub .ttr').eq(0).text())
+
+    @property
+    def rows(self):
+        for row in self._content.items('.menub tr'):
+            yield PyQueryRow(row)
+
+
+class LxmlBackend(object):
+    """
+    Walks the tree with precompiled XPath rather than wrapping every row
+    and cell in a PyQuery object. Gives exactly the same text as PyQuery.
+    """
+    TITLES = css_to_xpath('.menub .ttr')
+    ROWS = css_to_xpath('.menub tr')
+
+    def __init__(self, content):
+        self._roots = pq(content)
+
+    @property
+    def title(self):
+        for root in self._roots:
+            for title in self.TITLES(root):
+                return strip_whitespace(element_text(title))
+        return ''
+
+    @property
+    def rows(self):
+        for root in self._roots:
+            for row in self.ROWS(root):
+                yield LxmlRow(row)
+
+
+BACKENDS = {
+    'pyquery': PyQueryBackend,
+    'lxml': LxmlBackend,
+}
+
+
+class MatcherRegistry(object):
+    """
+    The InfoMatchers for the company's basic data.
+
+    Each matcher declares the literal `prefix` its regex starts with. A row's
+    text is read once and a single regex, alternating between all the
+    prefixes, picks the one matcher worth trying. Matchers without a prefix
+    are tried in turn if that finds nothing.
+
+    Register a new matcher by decorating its class with `register`.
+    """
+    def __init__(self):
+        self._matchers = []
+        self._dispatch = None
+
+    def register(self, matcher):
+        self._matchers.append(matcher)
+        self._dispatch = None
+        return matcher
+
+    def __iter__(self):
+        return iter(self._matchers)
+
+    def _compile(self):
+        self._prefixed = [m for m in self._matchers if m.prefix]
+        self._unprefixed = [m for m in self._matchers if not m.prefix]
+        self._dispatch = re.compile('|'.join(
+            '(?P<m%d>%s)' % (n, re.escape(matcher.prefix))
+            for n, matcher in enumerate(self._prefixed)
+        ) or '(?!)')
+
+    def match(self, row):
+        if self._dispatch is None:
+            self._compile()
+
+        text = row.text
+        m = self._dispatch.match(text)
+        if m:
+            data = self._prefixed[int(m.lastgroup[1:])].attempt_match(row, text)
+            if data:
+                return data
+
+        for matcher in self._unprefixed:
+            data = matcher.attempt_match(row, text)
+            if data:
+                return data
+
+
+INFO_MATCHERS = MatcherRegistry()
 
 
 class InfoMatcher(object):
+    prefix = None
+
     @classmethod
-    def attempt_match(cls, cell):
-        text = strip_whitespace(cell.text())
+    def attempt_match(cls, row, text):
         match = cls.regex.match(text)
         if match:
-            return cls.process(cell, match)
+            return strip_whitespace(cls.process(row, match))
 
 
+@INFO_MATCHERS.register
 class AddressMatcher(InfoMatcher):
+    prefix = 'Head office'
     regex = re.compile(r'''
         Head\ office(?P<address>.+)
         (?:Tel.\s*(?P<tel>[-0-9]*)\s*)
@@ -24,7 +199,7 @@ class AddressMatcher(InfoMatcher):
     )
 
     @staticmethod
-    def process(cell, match):
+    def process(row, match):
         return dict(
             address=match.group('address'),
             tel=match.group('tel').strip('-'),
@@ -32,7 +207,9 @@ class AddressMatcher(InfoMatcher):
         )
 
 
+@INFO_MATCHERS.register
 class IncorporationDateMatcher(InfoMatcher):
+    prefix = 'Date of Incorporation : '
     regex = re.compile(r'''
         Date\ of\ Incorporation\ :\ (?P<date>.+)
         Registered\ &\ Paid-Up\ Capital
@@ -40,47 +217,59 @@ class IncorporationDateMatcher(InfoMatcher):
     )
 
     @staticmethod
-    def process(cell, match):
+    def process(row, match):
         incorp_date = iso_date(strip_whitespace(match.group('date')))
         return dict(
             date_incorporated=incorp_date,
         )
 
 
+@INFO_MATCHERS.register
 class WebsiteMatcher(InfoMatcher):
+    # Companies that have never changed their name have no history link
+    prefix = '[Click HERE for '
     regex = re.compile(r'''
-        \[Click\ HERE\ for\ History\ of\ Name\ Change\]\s
+        (?:\[Click\ HERE\ for\ History\ of\ Name\ Change\]\s)?
         \[Click\ HERE\ for\ Company\ Website\]
         ''', re.VERBOSE
     )
 
     @staticmethod
-    def process(cell, match):
-        a = cell.find('a')
+    def process(row, match):
+        a = row.links
         if a:
             return dict(
-                website=a[1].attrib['href']
+                website=a[-1].attrib['href']
             )
 
+
+@INFO_MATCHERS.register
 class RegisteredCapitalMatcher(InfoMatcher):
+    prefix = '- Registered '
     regex = re.compile('- Registered (?P<capital>.+ Baht)')
 
     @staticmethod
-    def process(cell, match):
+    def process(row, match):
         return dict(
             registered_capital=match.group('capital')
         )
 
+
+@INFO_MATCHERS.register
 class PaidUpCapitalMatcher(InfoMatcher):
+    prefix = '- Paid-Up Capital '
     regex = re.compile('- Paid-Up Capital (?P<capital>.+ Baht)')
 
     @staticmethod
-    def process(cell, match):
+    def process(row, match):
         return dict(
             paid_up_capital=match.group('capital')
         )
 
+
+@INFO_MATCHERS.register
 class AntiCorruptionMatcher(InfoMatcher):
+    prefix = 'Anti-corruption Progress Indicator :'
     regex = re.compile(r'''
         Anti-corruption\ Progress\ Indicator\ :\s
         Level\ (?P<rating>\d\w?)\s+\(As\ of\s(?P<date>[\d/]+)\)
@@ -98,7 +287,7 @@ class AntiCorruptionMatcher(InfoMatcher):
     }
 
     @classmethod
-    def process(cls, cell, match):
+    def process(cls, row, match):
         return dict(
             anti_corruption = dict(
                 rating = match.group('rating'),
@@ -107,39 +296,123 @@ class AntiCorruptionMatcher(InfoMatcher):
             )
         )
 
-INFO_MATCHERS = (
-    AddressMatcher,
-    IncorporationDateMatcher,
-    WebsiteMatcher,
-    RegisteredCapitalMatcher,
-    PaidUpCapitalMatcher,
-    AntiCorruptionMatcher,
-)
+
+class Section(object):
+    def __init__(self, name, headings, process):
+        self.name = name
+        self.headings = headings
+        self.process = process
+
+
+class SectionRegistry(object):
+    """
+    The sections of a company page, each introduced by a `ttr` heading row.
+
+    A section is recognised by how its heading starts, except for the basic
+    data at the top, which is headed by the company's name (no `headings`).
+    The section's name is also its key in the data; each section with
+    headings collects a list there.
+
+    Declare a section by decorating its row processor with `section`, or
+    add one from outside with `add`. The processor is called with the
+    CompanyPage and each row in the section. A registry can start as a copy
+    of another, for a subclass to extend.
+    """
+    def __init__(self, sections=()):
+        self._sections = list(sections)
+
+    def add(self, name, headings, process):
+        self._sections.append(Section(name, headings, process))
+
+    def section(self, name, *headings):
+        def decorator(process):
+            self.add(name, headings or None, process)
+            return process
+        return decorator
+
+    def __iter__(self):
+        return iter(self._sections)
+
+    def find(self, heading, title):
+        """The section introduced by `heading`, on the page for `title`"""
+        for section in self._sections:
+            for prefix in section.headings or (title,):
+                if heading.startswith(prefix):
+                    return section
+
+
+class CompanyData(dict):
+    """
+    The data from a CompanyPage, which parses the sections it was asked to
+    leave out when a key it doesn't have yet is looked up, with [] or `get`.
+    """
+    def __init__(self, page):
+        super(CompanyData, self).__init__()
+        self._page = page
+
+    def __missing__(self, key):
+        if self._page._process_rest():
+            return self[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
 
 class CompanyPage(object):
-    def __init__(self, content):
-        self._content = pq(content)
-        self._last_heading = ''
-        self._last_license_row = []
+    """
+    Details of one company from its profile page.
+
+    `backend` chooses how the page is read: 'lxml' (the default) walks the
+    tree directly, 'pyquery' goes through PyQuery. Both give the same data.
+
+    `sections` names the sections to parse, e.g. {'basic', 'licenses'}
+    (default: all of them). Parsing stops once those have been read, and
+    the rest are only parsed if one of their keys is looked up.
+
+    `row_counts` gives how many rows of each section have been parsed, and
+    `name_change_link` where its history of name changes is, if anywhere.
+    """
+    SECTIONS = SectionRegistry()
+
+    def __init__(self, content, backend='lxml', sections=None):
+        self._page = content
+        self._content = BACKENDS[backend](content)
+        names = set(section.name for section in self.SECTIONS)
+        if sections is None:
+            sections = names
+        unknown = set(sections) - names
+        if unknown:
+            raise ValueError('Unknown sections: %s' % ', '.join(sorted(unknown)))
+        self._sections = set(sections)
+        self._processed = set()
+        self.row_counts = {}
 
-    def _process_basic_data(self, row):
-        for matcher in INFO_MATCHERS:
-            data = matcher.attempt_match(row)
-            if data:
-                self._data.update(data.items())
-                break
+    @property
+    def name_change_link(self):
+        return find_name_change_link(self._page)
 
+    @SECTIONS.section('basic')
+    def _process_basic_data(self, row):
+        data = INFO_MATCHERS.match(row)
+        if data:
+            self._data.update(data.items())
+
+    @SECTIONS.section(
+        'licenses',
+        'Under the Securities & Exchange Act',
+        'Under the Derivatives Act',
+    )
     def _process_license(self, row):
-        cells = list(row.items('td'))
+        cells = row.cells
         if len(cells) == 6:
             if len(self._last_license_row) != 6:
                 self._last_license_row = [''] * 6
 
-            self._last_license_row = hungry_merge(
-                self._last_license_row,
-                [cell.text() for cell in cells]
-            )
+            self._last_license_row = hungry_merge(self._last_license_row, cells)
 
             license_type, num, eff_date, business, start_date, remark = self._last_license_row
 
@@ -155,10 +428,7 @@ class CompanyPage(object):
         if len(cells) == 3:
             if len(self._last_license_row) != 3:
                 self._last_license_row = [''] * 3
-            self._last_license_row = hungry_merge(
-                self._last_license_row,
-                [cell.text() for cell in cells]
-            )
+            self._last_license_row = hungry_merge(self._last_license_row, cells)
 
             license_type, eff_date, remark = self._last_license_row
             self._data['licenses'].append({
@@ -167,83 +437,96 @@ class CompanyPage(object):
                 'remark': remark,
             })
 
+    @SECTIONS.section('major_shareholders', 'Approved Major shareholder')
     def _process_major_shareholder(self, row):
-        cells = list(row.items('td'))
+        cells = row.cells
         if len(cells) == 3:
             _, name, percent = cells
             self._data['major_shareholders'].append({
-                'name': name.text(),
-                'percentage': float(percent.text().strip('%'))
+                'name': name,
+                'percentage': float(percent.strip('%'))
             })
 
+    @SECTIONS.section('executives', 'Executives')
     def _process_executive(self, row):
-        cells = list(row.items('td'))
+        cells = row.cells
         if len(cells) == 4:
             _, name, position, nationality = cells
             self._data['executives'].append({
-                'name': name.text(),
-                'position': position.text(),
-                'nationality': nationality.text(),
+                'name': name,
+                'position': position,
+                'nationality': nationality,
             })
 
+    @SECTIONS.section(
+        'fund_managers',
+        'Register of persons qualified to be Fund Manager',
+    )
     def _process_fund_manager(self, row):
-        cells = list(row.items('td'))
+        cells = row.cells
         if len(cells) == 7:
             _, name, is_mf, is_df, approval, appointed, training = cells
             self._data['fund_managers'].append({
-                'name': name.text(),
-                'type': 'mutual' if is_mf.text() else 'derivative',
-                'approval_date': iso_date(approval.text()),
-                'appointed_date': iso_date(appointed.text()),
-                'training_deadline': iso_date(training.text()),
+                'name': name,
+                'type': 'mutual' if is_mf else 'derivative',
+                'approval_date': iso_date(approval),
+                'appointed_date': iso_date(appointed),
+                'training_deadline': iso_date(training),
             })
 
+    @SECTIONS.section('head_of_compliance', 'Head of Compliance')
     def _process_head_of_compliance(self, row):
-        cells = list(row.items('td'))
+        cells = row.cells
         if len(cells) == 2:
             name, start_date = cells
             self._data['head_of_compliance'].append({
-                'name': name.text(),
-                'start_date': iso_date(start_date.text()),
+                'name': name,
+                'start_date': iso_date(start_date),
             })
 
-    def _process(self):
-        self._data = {
-            'name': self._content('.menub .ttr').eq(0).text(),
-            'licenses': [],
-            'major_shareholders': [],
-            'executives': [],
-            'fund_managers': [],
-            'head_of_compliance': [],
-        }
-
-        PROCESSORS = (
-            (self._data['name'], self._process_basic_data),
-            ('Under the Securities & Exchange Act', self._process_license),
-            ('Under the Derivatives Act', self._process_license),
-            ('Approved Major shareholder', self._process_major_shareholder),
-            ('Executives', self._process_executive),
-            ('Register of persons qualified to be Fund Manager', self._process_fund_manager),
-            ('Head of Compliance', self._process_head_of_compliance)
-        )
+    def _process(self, wanted):
+        """
+        Parse the sections named in `wanted`, stopping at the first heading
+        after all of them have been read.
+        """
+        for section in self.SECTIONS:
+            if section.name in wanted and section.headings:
+                self._data[section.name] = []
+        self._last_license_row = []
+        unread = set(wanted)
 
-        for row in self._content.items('.menub tr'):
-            if row.attr['class'] == 'ttr':
+        # Only headings can change the section, so look it up there
+        section = self.SECTIONS.find('', self._data['name'])
+        for row in self._content.rows:
+            if row.classes == 'ttr':
                 # main headings
-                self._last_heading = row.text()
+                section = self.SECTIONS.find(row.text, self._data['name'])
+                if section and section.name in wanted:
+                    unread.discard(section.name)
+                elif not unread:
+                    break
 
-            elif row.attr['class'] == 'ttr01':
+            elif row.classes == 'ttr01':
                 # subheadings
                 pass
 
-            else:
-                for heading, process in PROCESSORS:
-                    if self._last_heading.startswith(heading):
-                        process(row)
-                        break
+            elif section and section.name in wanted:
+                section.process(self, row)
+                self.row_counts[section.name] = self.row_counts.get(section.name, 0) + 1
+
+        self._processed.update(wanted)
+
+    def _process_rest(self):
+        """Parse the sections left out so far, if there are any"""
+        rest = set(section.name for section in self.SECTIONS) - self._processed
+        if rest:
+            self._process(rest)
+        return bool(rest)
 
     @property
     def data(self):
         if not hasattr(self, '_data'):
-            self._process()
-        return strip_whitespace(self._data)
+            self._data = CompanyData(self)
+            self._data['name'] = self._content.title
+            self._process(self._sections)
+        return self._data
@@ -0,0 +1,269 @@
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+from multiprocessing.pool import ThreadPool
+from urlparse import urlsplit
+
+import requests
+
+from metrics import NO_METRICS
+from session import Session
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket.
+
+    Tokens accrue at `rate` per second up to `burst`; each request spends one.
+    """
+    def __init__(self, rate, burst=1, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(
+            self.burst,
+            self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def _take(self):
+        """Spend a token if there is one, else say how long until there is"""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                delay = self._take()
+            if not delay:
+                return
+            self._sleep(delay)
+
+    def succeeded(self, seconds):
+        """A request got a response in `seconds`; a fixed rate ignores it"""
+
+    def failed(self, retry_after=None):
+        """A request failed; a fixed rate ignores it"""
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """
+    A token bucket whose rate follows how well the server is coping.
+
+    The rate creeps up by `increase` requests a second, each second, while
+    responses come back within `slow` seconds, and is cut by `decrease`
+    when one is slower or a request fails (additive increase,
+    multiplicative decrease). It stays between `min_rate` and `max_rate`.
+    A `retry_after` from the server pauses requests for that long.
+
+    Requests in flight when the server starts struggling will all report
+    it, so the rate is only cut once every `cooldown` seconds.
+    """
+    def __init__(self, rate, burst=1, min_rate=0.25, max_rate=8.0,
+                 increase=0.5, decrease=0.5, slow=5.0, cooldown=2.0, **kwargs):
+        super(AdaptiveTokenBucket, self).__init__(rate, burst, **kwargs)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.slow = slow
+        self.cooldown = cooldown
+        self._paused_until = None
+        self._backed_off = None
+
+    def _take(self):
+        if self._paused_until is not None:
+            delay = self._paused_until - self._clock()
+            if delay > 0:
+                return delay
+            # Free to go the moment the pause is up
+            self._paused_until = None
+            self._updated = self._clock()
+            self._tokens = 1.0
+        return super(AdaptiveTokenBucket, self)._take()
+
+    def _set_rate(self, rate):
+        # Tokens so far accrue at the old rate
+        self._refill()
+        self.rate = min(self.max_rate, max(self.min_rate, rate))
+
+    def _back_off(self):
+        now = self._clock()
+        if self._backed_off is None or now - self._backed_off >= self.cooldown:
+            self._backed_off = now
+            self._set_rate(self.rate * self.decrease)
+
+    def succeeded(self, seconds):
+        with self._lock:
+            if seconds > self.slow:
+                self._back_off()
+            else:
+                self._set_rate(self.rate + self.increase / self.rate)
+
+    def failed(self, retry_after=None):
+        with self._lock:
+            self._back_off()
+            if retry_after:
+                self._refill()
+                self._tokens = 0
+                self._paused_until = max(
+                    self._paused_until or 0, self._clock() + retry_after
+                )
+
+
+class RateLimiter(object):
+    """
+    One token bucket per host, created on first use.
+
+    With `adaptive`, each host's rate adjusts to how its server copes, and
+    the other arguments go to AdaptiveTokenBucket.
+    """
+    def __init__(self, rate, burst=1, adaptive=False, **kwargs):
+        self.bucket_class = AdaptiveTokenBucket if adaptive else TokenBucket
+        self.rate = rate
+        self.burst = burst
+        self._kwargs = kwargs
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = self.bucket_class(
+                    self.rate, self.burst, **self._kwargs
+                )
+            return self._buckets[host]
+
+    def wait(self, url):
+        self.bucket(url).acquire()
+
+    def succeeded(self, url, seconds):
+        self.bucket(url).succeeded(seconds)
+
+    def failed(self, url, retry_after=None):
+        self.bucket(url).failed(retry_after)
+
+
+def retry_after(response):
+    """Seconds a response's Retry-After header asks us to wait, if any"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        date = parsedate_tz(value)
+        if date:
+            return max(0, mktime_tz(date) - time.time())
+
+
+class Fetcher(object):
+    """
+    Fetches pages on a pool of threads.
+
+    `submit` returns immediately with an AsyncResult; call `.get()` on it
+    to wait for the page. Every request is paced by a per-host rate limit,
+    however many threads are running.
+
+    Pages come back as raw bytes from `session`, which defaults to a pooled
+    keep-alive Session sized to match the number of threads.
+
+    The rate limit is `limiter`, by default a fixed `rate` and `burst` per
+    host. It hears how long each request took, and about each that failed
+    for reasons the server might recover from: a 5xx or 429 response (with
+    any Retry-After) or a broken connection.
+
+    A 5xx or 429 response is retried up to `retries` times, each attempt
+    waiting its turn with the limiter, after the Retry-After or else an
+    exponential backoff of `backoff` seconds.
+
+    An offline session's pages come from its cache, so they don't wait on
+    the limiter, or count towards it.
+
+    Time spent waiting on the rate limit goes to `metrics`.
+    """
+    def __init__(self, concurrency=4, rate=2.0, burst=1, session=None,
+                 metrics=None, limiter=None, retries=3, backoff=0.5,
+                 sleep=time.sleep):
+        self.limiter = limiter or RateLimiter(rate, burst)
+        self.metrics = metrics or NO_METRICS
+        self.session = session or Session(pool_size=concurrency, metrics=metrics)
+        self.retries = retries
+        self.backoff = backoff
+        self._sleep = sleep
+        self._pool = ThreadPool(concurrency)
+
+    def _fetch(self, url):
+        if self.session.offline:
+            return self.session.get(url)
+
+        for attempt in range(self.retries + 1):
+            with self.metrics.timer('throttle_seconds'):
+                self.limiter.wait(url)
+
+            start = time.time()
+            try:
+                page = self.session.get(url, attempt=attempt)
+            except requests.RequestException as e:
+                response = getattr(e, 'response', None)
+                if response is None:
+                    # urllib3 has already retried the connection
+                    self.limiter.failed(url)
+                    raise
+                if response.status_code < 500 and response.status_code != 429:
+                    raise
+                delay = retry_after(response)
+                self.limiter.failed(url, delay)
+                if attempt == self.retries:
+                    raise
+                if delay is None:
+                    delay = self.backoff * 2 ** attempt
+                self._sleep(delay)
+                continue
+            self.limiter.succeeded(url, time.time() - start)
+            return page
+
+    def submit(self, url):
+        return self._pool.apply_async(self._fetch, (url,))
+
+    def fetch(self, url):
+        return self.submit(url).get()
+
+    def _fetch_followed(self, url, follow):
+        page = self._fetch(url)
+        followed_url = follow(page)
+        return page, self._fetch(followed_url) if followed_url else None
+
+    def submit_followed(self, url, follow):
+        """
+        Fetch `url`, then the page at `follow(page)`, unless that's None,
+        on the same thread. The AsyncResult gives both pages, or the first
+        and None.
+        """
+        return self._pool.apply_async(self._fetch_followed, (url, follow))
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.terminate()
+            self.session.close()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Look companies up in the scraper's records by name, former name, license
+number or executive, without reading through the whole file.
+
+    python lookup.py build records.jsonl.gz lookup.sqlite
+    python lookup.py update changed.jsonl.gz lookup.sqlite
+    python lookup.py find lookup.sqlite --name "aec secur"
+    python lookup.py find lookup.sqlite --license "ลก-0061-01"
+    python lookup.py find lookup.sqlite --executive "MR. PAISIT KAENCHAN"
+
+Names, current and former, are full-text indexed: every word given must
+start a word of the name. License numbers and executives' names are
+matched exactly, executives ignoring case. Matching records are printed one
+JSON object per line.
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+
+from output import read_records
+from utils import company_id
+
+
+class LookupStore(object):
+    """
+    Companies' records in SQLite, indexed for lookups.
+
+    Adding a record for a company that's already in the store replaces it.
+    Additions are only saved by `commit`, or on leaving a `with` block.
+    """
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS companies (
+                id INTEGER PRIMARY KEY,
+                cno TEXT UNIQUE NOT NULL,
+                record TEXT NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts4 (name, old_names);
+            CREATE TABLE IF NOT EXISTS licenses (
+                number TEXT NOT NULL,
+                company INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS licenses_number ON licenses (number);
+            CREATE TABLE IF NOT EXISTS executives (
+                name TEXT NOT NULL COLLATE NOCASE,
+                company INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS executives_name ON executives (name);
+        ''')
+        self._db.commit()
+
+    def remove(self, cno):
+        row = self._db.execute(
+            'SELECT id FROM companies WHERE cno = ?', (cno,)
+        ).fetchone()
+        if row:
+            for table, column in [('companies', 'id'), ('names', 'docid'),
+                                  ('licenses', 'company'), ('executives', 'company')]:
+                self._db.execute(
+                    'DELETE FROM %s WHERE %s = ?' % (table, column), (row[0],)
+                )
+
+    def add(self, record):
+        cno = company_id(record['source_url']) or record['source_url']
+        self.remove(cno)
+
+        company = self._db.execute(
+            'INSERT INTO companies (cno, record) VALUES (?, ?)',
+            (cno, json.dumps(record))
+        ).lastrowid
+        self._db.execute(
+            'INSERT INTO names (docid, name, old_names) VALUES (?, ?, ?)',
+            (company, record.get('name') or '', '\n'.join(
+                old_name['name'] for old_name in record.get('old_names') or []
+            ))
+        )
+        self._db.executemany(
+            'INSERT INTO licenses VALUES (?, ?)',
+            set((license['number'], company)
+                for license in record.get('licenses') or [] if license.get('number'))
+        )
+        self._db.executemany(
+            'INSERT INTO executives VALUES (?, ?)',
+            set((executive['name'], company)
+                for executive in record.get('executives') or [])
+        )
+
+    def companies(self):
+        return [cno for (cno,) in self._db.execute('SELECT cno FROM companies')]
+
+    def _records(self, query, params):
+        return [json.loads(record) for (record,) in self._db.execute(query, params)]
+
+    def get(self, cno):
+        records = self._records('SELECT record FROM companies WHERE cno = ?', (cno,))
+        if records:
+            return records[0]
+
+    def by_name(self, text, limit=20):
+        """
+        Companies with a current or former name in which each word of
+        `text` starts a word
+        """
+        words = re.findall(r'\w+', text, re.UNICODE)
+        if not words:
+            return []
+        return self._records('''
+            SELECT record FROM names JOIN companies ON companies.id = names.docid
+            WHERE names MATCH ? ORDER BY companies.id LIMIT ?
+        ''', (' '.join(word + '*' for word in words), limit))
+
+    def by_license(self, number):
+        return self._records('''
+            SELECT record FROM companies WHERE id IN (
+                SELECT company FROM licenses WHERE number = ?
+            ) ORDER BY id
+        ''', (number,))
+
+    def by_executive(self, name):
+        return self._records('''
+            SELECT record FROM companies WHERE id IN (
+                SELECT company FROM executives WHERE name = ?
+            ) ORDER BY id
+        ''', (name,))
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        self.close()
+
+
+def load(records, store_path):
+    """
+    Build a lookup store at `store_path` from `records`, replacing it only
+    once it's complete.
+    """
+    partial = store_path + '.partial'
+    if os.path.exists(partial):
+        os.remove(partial)
+    with LookupStore(partial) as store:
+        for record in records:
+            store.add(record)
+    os.rename(partial, store_path)
+
+
+def build(path, store_path):
+    """Build a lookup store at `store_path` from the records in the file at `path`"""
+    load(read_records(path), store_path)
+
+
+def update(path, store_path, listed=None):
+    """
+    Add the records in the file at `path` to the lookup store at
+    `store_path`, replacing those of the same companies: for a run that only
+    wrote out the companies that changed. Given the `cno` of every company
+    `listed` now, the rest are removed.
+    """
+    with LookupStore(store_path) as store:
+        for record in read_records(path):
+            store.add(record)
+        if listed is not None:
+            for cno in store.companies():
+                if cno not in listed:
+                    store.remove(cno)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    commands = parser.add_subparsers(dest='command')
+
+    build_command = commands.add_parser('build', help='build a lookup store')
+    build_command.add_argument('records', help='file of records written by the scraper')
+    build_command.add_argument('store', help='where to write the lookup store')
+
+    update_command = commands.add_parser(
+        'update', help='add changed companies to a lookup store'
+    )
+    update_command.add_argument('records', help='file of records written by the scraper')
+    update_command.add_argument('store', help='the lookup store')
+
+    find = commands.add_parser('find', help='look companies up')
+    find.add_argument('store', help='the lookup store')
+    lookups = find.add_mutually_exclusive_group(required=True)
+    lookups.add_argument('--cno', help='the company\'s id')
+    lookups.add_argument('--name', help='words from a current or former name')
+    lookups.add_argument('--license', help='a license number')
+    lookups.add_argument('--executive', help='an executive\'s full name')
+    find.add_argument('--limit', type=int, default=20, help='most names to match')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.command == 'build':
+        build(args.records, args.store)
+    elif args.command == 'update':
+        update(args.records, args.store)
+    else:
+        with LookupStore(args.store) as store:
+            if args.cno:
+                records = filter(None, [store.get(args.cno)])
+            elif args.name:
+                records = store.by_name(args.name.decode('utf-8'), args.limit)
+            elif args.license:
+                records = store.by_license(args.license.decode('utf-8'))
+            else:
+                records = store.by_executive(args.executive.decode('utf-8'))
+        for record in records:
+            print json.dumps(record, sort_keys=True)
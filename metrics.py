@@ -0,0 +1,143 @@
+"""
+Counts and timings from a run, to see where the time goes.
+
+Each measurement is observed under a name and labels, and summarised as a
+count, total and maximum. A summary goes to the log at the end of the run,
+and `dump` writes the lot out as JSON or in Prometheus' text format.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Summary(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = None
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': self.total, 'max': self.max}
+
+
+class Metrics(object):
+    """
+    Collects measurements from every thread of a run.
+
+    With `trace`, each page fetch is also kept individually, by URL.
+    """
+    enabled = True
+
+    def __init__(self, trace=False):
+        self.tracing = trace
+        self.traces = []
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = Summary()
+            summary.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe how many seconds the `with` block takes"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def trace(self, **event):
+        if self.tracing:
+            with self._lock:
+                self.traces.append(event)
+
+    def summaries(self):
+        """(name, labels, Summary) for everything observed, in order"""
+        with self._lock:
+            items = sorted(self._summaries.items())
+        return [(name, dict(labels), summary) for (name, labels), summary in items]
+
+    def summary(self):
+        """A human-readable table of everything observed"""
+        lines = ['%-48s %8s %12s %10s' % ('metric', 'count', 'total', 'max')]
+        for name, labels, summary in self.summaries():
+            if labels:
+                name += ' ' + ' '.join('%s=%s' % item for item in sorted(labels.items()))
+            lines.append('%-48s %8d %12.3f %10.3f' % (
+                name, summary.count, summary.total, summary.max,
+            ))
+        return '\n'.join(lines)
+
+    def as_json(self):
+        data = {
+            'metrics': [
+                dict(summary.as_dict(), name=name, labels=labels)
+                for name, labels, summary in self.summaries()
+            ]
+        }
+        if self.tracing:
+            data['traces'] = list(self.traces)
+        return data
+
+    def prometheus(self):
+        """Everything observed, in Prometheus' text exposition format"""
+        lines = []
+        seen = set()
+        for name, labels, summary in self.summaries():
+            metric = 'turbot_sec_' + name
+            if metric not in seen:
+                lines.append('# TYPE %s summary' % metric)
+                seen.add(metric)
+            label_text = ','.join(
+                '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                for key, value in sorted(labels.items())
+            )
+            if label_text:
+                label_text = '{%s}' % label_text
+            lines.append('%s_count%s %d' % (metric, label_text, summary.count))
+            lines.append('%s_sum%s %r' % (metric, label_text, float(summary.total)))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """Write everything out: as JSON for a .json file, else for Prometheus"""
+        with open(path, 'w') as f:
+            if path.endswith('.json'):
+                json.dump(self.as_json(), f, indent=2, sort_keys=True)
+            else:
+                f.write(self.prometheus())
+
+
+class NoMetrics(object):
+    """Stands in for Metrics when they're turned off, doing nothing at all"""
+    enabled = False
+    tracing = False
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def timer(self, name, **labels):
+        return self
+
+    def trace(self, **event):
+        pass
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NO_METRICS = NoMetrics()
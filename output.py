@@ -0,0 +1,199 @@
+import gzip
+import io
+import json
+import os
+import sys
+import time
+from StringIO import StringIO
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def gzip_compress(data):
+    """One complete gzip member; members can be concatenated"""
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def zstd_compress(data):
+    """One complete zstd frame; frames can be concatenated"""
+    return zstandard.ZstdCompressor().compress(data)
+
+
+COMPRESSORS = {
+    None: lambda data: data,
+    'gzip': gzip_compress,
+    'zstd': zstd_compress,
+}
+
+EXTENSIONS = {
+    '.gz': 'gzip',
+    '.zst': 'zstd',
+}
+
+
+def compression_for(path):
+    """The compression implied by a file name's extension"""
+    return EXTENSIONS.get(os.path.splitext(path or '')[1])
+
+
+def open_output(path):
+    """Open a file of records for reading, decompressing it if need be"""
+    compression = compression_for(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd output needs the zstandard package')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+            open(path, 'rb'), read_across_frames=True
+        ))
+    return open(path, 'rb')
+
+
+def read_records(path):
+    """Each record in a file written by RecordWriter, in turn"""
+    with open_output(path) as f:
+        for line in f:
+            yield json.loads(line)
+
+
+class RecordWriter(object):
+    """
+    Writes records as newline-delimited JSON, in batches.
+
+    Records are buffered and written out once `batch_size` have built up or
+    `flush_interval` seconds have passed since the last write, whichever
+    comes first. With no `path` they go to stdout.
+
+    A file is written as `<path>.partial` and only renamed to `path` when the
+    writer is closed, so a finished file is always complete. With
+    `compression` ('gzip' or 'zstd') each batch is its own gzip member or
+    zstd frame, so the partial file is readable up to the last flush.
+
+    With no `batch_size` or `flush_interval`, records are only written out
+    when `flush` is called.
+
+    After each flush `on_flush` is called with the number of bytes written
+    so far. Passing that back as `resume_from` picks up an interrupted
+    partial file at that point rather than starting it again.
+    """
+    def __init__(self, path=None, compression=None, batch_size=100,
+                 flush_interval=5.0, on_flush=None, resume_from=None,
+                 clock=time.time):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError('zstd output needs the zstandard package')
+        self._compress = COMPRESSORS[compression]
+        self._clock = clock
+        self._buffer = []
+        self._flushed = clock()
+
+        if path is None:
+            self._file = sys.stdout
+        else:
+            self._partial_path = path + '.partial'
+            if resume_from is not None and os.path.exists(self._partial_path):
+                self._file = open(self._partial_path, 'r+b')
+                self._file.truncate(resume_from)
+                self._file.seek(resume_from)
+            else:
+                self._file = open(self._partial_path, 'wb')
+
+    def write(self, record):
+        self._buffer.append(json.dumps(record) + '\n')
+        if ((self.batch_size and len(self._buffer) >= self.batch_size) or
+                (self.flush_interval is not None and
+                 self._clock() - self._flushed >= self.flush_interval)):
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(self._compress(''.join(self._buffer)))
+            self._buffer = []
+        self._file.flush()
+        if self.path is not None:
+            os.fsync(self._file.fileno())
+        self._flushed = self._clock()
+        if self.on_flush:
+            self.on_flush(self.tell())
+
+    def tell(self):
+        return self._file.tell() if self.path is not None else None
+
+    def close(self):
+        """Write out what's left and put the finished file in place"""
+        self.flush()
+        if self.path is not None:
+            self._file.close()
+            os.rename(self._partial_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep what we have, ready to resume
+            self.flush()
+            if self.path is not None:
+                self._file.close()
+
+
+class Outputs(object):
+    """
+    RecordWriters for several streams of records, by name, that are always
+    flushed together so that they stand at the same point in the run.
+
+    `outputs` gives the (name, path) of each. The first decides when to
+    flush, by `batch_size` and `flush_interval`; then `on_flush` is called
+    with how far into each file they've been written, by name, and each
+    resumes from its offset in `resume_from`.
+    """
+    def __init__(self, outputs, compression=None, batch_size=100,
+                 flush_interval=5.0, on_flush=None, resume_from=None):
+        self.on_flush = on_flush
+        self._writers = []
+        for n, (name, path) in enumerate(outputs):
+            leader = n == 0
+            self._writers.append((name, RecordWriter(
+                path,
+                compression=compression or compression_for(path),
+                batch_size=batch_size if leader else None,
+                flush_interval=flush_interval if leader else None,
+                on_flush=self._flushed if leader else None,
+                resume_from=(resume_from or {}).get(name),
+            )))
+
+    def get(self, name):
+        return dict(self._writers).get(name)
+
+    def _flushed(self, offset):
+        for name, writer in self._writers[1:]:
+            writer.flush()
+        if self.on_flush:
+            self.on_flush(dict(
+                (name, writer.tell()) for name, writer in self._writers
+                if writer.tell() is not None
+            ))
+
+    def close(self):
+        # The first goes first, as closing it flushes the rest
+        for name, writer in self._writers:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for name, writer in self._writers:
+            writer.__exit__(exc_type, exc_value, traceback)
@@ -0,0 +1,121 @@
+import multiprocessing
+import time
+
+from company_name_change_page import CompanyNameChangePage
+from company_page import CompanyPage
+
+
+def old_names(name_change_page):
+    if name_change_page is None:
+        return []
+    return CompanyNameChangePage(name_change_page).old_names
+
+
+def parse_company(company_page, name_change_page):
+    """
+    A company's record from its fetched company and name change pages. A
+    company that has never changed its name has no name change page (None).
+    """
+    data = dict(CompanyPage(company_page).data)
+    data['old_names'] = old_names(name_change_page)
+    return data
+
+
+def measure_company(company_page, name_change_page):
+    """
+    Parse a company's pages as `parse_company` does, giving the record along
+    with the seconds spent on each page and the rows in each section.
+    """
+    start = time.time()
+    page = CompanyPage(company_page)
+    data = dict(page.data)
+    parsed = time.time()
+    data['old_names'] = old_names(name_change_page)
+    stats = {
+        'seconds': {
+            'company': parsed - start,
+            'name_change': time.time() - parsed,
+        },
+        'rows': page.row_counts,
+    }
+    return data, stats
+
+
+class Measured(object):
+    """
+    The record from a `measure_company` job, passing its measurements on to
+    `metrics` once it's ready.
+    """
+    def __init__(self, job, metrics):
+        self._job = job
+        self._metrics = metrics
+
+    def ready(self):
+        return self._job.ready()
+
+    def get(self, timeout=None):
+        data, stats = self._job.get(timeout)
+        if self._metrics:
+            for page, seconds in stats['seconds'].items():
+                self._metrics.observe('parse_seconds', seconds, page=page)
+            for section, rows in stats['rows'].items():
+                self._metrics.observe('section_rows', rows, section=section)
+            self._metrics = None
+        return data
+
+
+class Finished(object):
+    """Stands in for an AsyncResult when the work is already done"""
+
+    def __init__(self, value):
+        self._value = value
+
+    def ready(self):
+        return True
+
+    def get(self, timeout=None):
+        return self._value
+
+
+class ParserPool(object):
+    """
+    Parses company pages in a pool of worker processes, so that parsing
+    uses every core and never holds up the threads fetching pages.
+
+    `submit` returns an AsyncResult whose `get()` gives the plain dict
+    record. With `processes=0` pages are parsed in this process instead.
+
+    Parse times and rows per section go to `metrics`.
+    """
+    def __init__(self, processes=None, metrics=None):
+        self.metrics = metrics if metrics and metrics.enabled else None
+        if processes == 0:
+            self._pool = None
+        else:
+            self._pool = multiprocessing.Pool(processes)
+
+    def submit(self, company_page, name_change_page):
+        if self.metrics:
+            return Measured(self._apply(
+                measure_company, company_page, name_change_page
+            ), self.metrics)
+        return self._apply(parse_company, company_page, name_change_page)
+
+    def _apply(self, parse, *pages):
+        if self._pool is None:
+            return Finished(parse(*pages))
+        return self._pool.apply_async(parse, pages)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._pool is not None:
+            self._pool.terminate()
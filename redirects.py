@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+
+class RedirectCache(object):
+    """
+    Where each link off the main index ends up after its JavaScript
+    redirect, remembered between runs.
+
+    A target is trusted for `max_age` seconds after it was found, then
+    looked up again. A link without a redirect is stored as its own target.
+    """
+    def __init__(self, path, max_age=7 * 24 * 60 * 60, clock=time.time):
+        self.max_age = max_age
+        self._clock = clock
+        self._db = sqlite3.connect(path)
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS redirects (
+                url TEXT PRIMARY KEY,
+                target TEXT NOT NULL,
+                found REAL NOT NULL
+            )
+        ''')
+        self._db.commit()
+
+    def get(self, url):
+        """The link's target, if we found it recently enough"""
+        row = self._db.execute(
+            'SELECT target FROM redirects WHERE url = ? AND found >= ?',
+            (url, self._clock() - self.max_age)
+        ).fetchone()
+        if row:
+            return row[0]
+
+    def put(self, url, target):
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO redirects VALUES (?, ?, ?)',
+                (url, target, self._clock())
+            )
+
+    def forget(self, url):
+        with self._db:
+            self._db.execute('DELETE FROM redirects WHERE url = ?', (url,))
+
+    def close(self):
+        self._db.close()
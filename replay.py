@@ -0,0 +1,347 @@
+"""
+A stand-in for the SEC site, built from the pages in data/, for running the
+whole scraper locally.
+
+    python replay.py --companies 2000           # benchmark the whole pipeline
+    python replay.py --latency 0.05 --error-rate 0.01 --slow-rate 0.01
+
+    python replay.py --serve --port 8765        # or just serve the site...
+    python scraper.py --proxy http://127.0.0.1:8765 --no-cache --restart
+
+The site is served as an HTTP proxy, so the scraper fetches the real URLs.
+Any number of companies are generated, spread over the categories on the
+main index (some under two), each behind a JavaScript redirect.
+"""
+import argparse
+import json
+import random
+import re
+import resource
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qsl, urlsplit
+
+from benchmark import fixture
+from cache import normalize_url
+from main_index import MainIndex
+
+
+INDEX_URL = 'http://capital.sec.or.th/webapp/en/infocenter/intermed/comprofile/COMPANYPROFILE03.aspx?category=%d'
+REDIRECT = "<html><head><script type='text/javascript'>document.location='%s'</script></head></html>"
+
+INDEX_ROW = re.compile(r'<tr class="rg(?:Alt)?Row"[^>]*>(?:(?!<tr).)*?</tr>', re.DOTALL)
+NAME_CHANGE_LINK = re.compile(r'<a href=showcomphist\.php[^>]*>[^<]*</a>')
+FIXTURE_COMPANY = 'AEC SECURITIES PUBLIC COMPANY LIMITED'
+
+
+class ReplaySite(object):
+    """
+    The pages of the site, made up from the fixtures.
+
+    `companies` companies are listed across the categories on the main
+    index, every `overlap`th one under the next category too. With
+    `redirects`, each category link leads to its index by JavaScript.
+    Every `renamed`th company links to a history of name changes.
+    """
+    def __init__(self, companies=42, overlap=5, redirects=True, renamed=3):
+        self.redirects = redirects
+        self.renamed = renamed
+        self.main_index = fixture('ListofBusinessOperators.aspx')
+
+        self._categories = {}
+        for link in MainIndex(self.main_index).links:
+            self._categories.setdefault(normalize_url(link['url']), len(self._categories))
+
+        self.cnos = ['%010d' % (n + 1) for n in range(companies)]
+        self.listings = dict((position, []) for position in range(len(self._categories)))
+        for n, cno in enumerate(self.cnos):
+            self.listings[n % len(self.listings)].append(cno)
+            if overlap and n % overlap == 0:
+                self.listings[(n + 1) % len(self.listings)].append(cno)
+        self._known = set(self.cnos)
+
+        index = fixture('COMPANYPROFILE03.aspx')
+        rows = list(INDEX_ROW.finditer(index))
+        self._index_head = index[:rows[0].start()]
+        self._index_row = rows[0].group(0)
+        self._index_tail = index[rows[-1].end():]
+
+        self._company = fixture('company.html')
+        self._name_change = fixture('namechange.html')
+
+    def index_page(self, position):
+        rows = []
+        for n, cno in enumerate(self.listings[position], 1):
+            row = re.sub(r'cno=\d+', 'cno=' + cno, self._index_row)
+            row = re.sub(r'(<td align="center"[^>]*>\s*)\d+', r'\g<1>%d' % n, row)
+            row = re.sub(r"(<a [^>]*>)[^<]*", r'\g<1>REPLAY SECURITIES %s CO.,LTD.' % cno, row)
+            rows.append(row)
+        return self._index_head + ''.join(rows) + self._index_tail
+
+    def company_page(self, cno):
+        page = self._company.replace(
+            FIXTURE_COMPANY, 'REPLAY SECURITIES %s COMPANY LIMITED' % cno
+        ).replace('cno=0000000505', 'cno=' + cno)
+        if not self.renamed or int(cno) % self.renamed:
+            page = NAME_CHANGE_LINK.sub('', page)
+        return page
+
+    def page(self, url):
+        """The body of the page at `url`, or None if there's no such page"""
+        parts = urlsplit(url)
+        name = parts.path.rsplit('/', 1)[-1]
+        query = dict(parse_qsl(parts.query))
+
+        if name == 'ListofBusinessOperators.aspx':
+            return self.main_index
+        if query.get('cno') in self._known:
+            if name.startswith('resultc_'):
+                return self.company_page(query['cno'])
+            if name == 'showcomphist.php':
+                return self._name_change
+        if name == 'COMPANYPROFILE03.aspx' and query.get('category', '').isdigit():
+            position = int(query['category'])
+            if position in self.listings:
+                return self.index_page(position)
+
+        position = self._categories.get(normalize_url(url))
+        if position is not None:
+            if self.redirects:
+                return REDIRECT % (INDEX_URL % position)
+            return self.index_page(position)
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = self.path
+        if '://' not in url:
+            url = 'http://%s%s' % (self.headers.get('Host'), url)
+
+        delay, fail = self.server.faults()
+        if delay:
+            time.sleep(delay)
+
+        if fail:
+            self.respond(503, 'Service Unavailable', self.server.retry_after)
+            return
+
+        body = self.server.site.page(url)
+        if body is None:
+            self.respond(404, 'Not Found')
+        else:
+            self.respond(200, body)
+
+    def respond(self, status, body, retry_after=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        if retry_after is not None:
+            self.send_header('Retry-After', str(retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves a ReplaySite, as a proxy, on a thread of its own.
+
+    Every response is held up by `latency` seconds, and a random
+    `slow_rate` of them by `slow_latency` more. A random `error_rate` of
+    requests get a 503, with a Retry-After if `retry_after` is given.
+    """
+    daemon_threads = True
+
+    def __init__(self, site, port=0, latency=0, error_rate=0, slow_rate=0,
+                 slow_latency=5.0, retry_after=None, seed=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), ReplayHandler)
+        self.site = site
+        self.latency = latency
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.retry_after = retry_after
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_port
+
+    def faults(self):
+        """How long to hold up the next response, and whether to fail it"""
+        with self._lock:
+            self.requests += 1
+            delay = self.latency
+            if self._random.random() < self.slow_rate:
+                delay += self.slow_latency
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        return delay, fail
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def run_pipeline(server, concurrency=8, rate=1000.0, adaptive=False,
+                 min_rate=0.25, max_rate=None, parse_processes=None, retries=3,
+                 backoff=0.5):
+    """
+    Scrape the whole site through `server`, as the scraper would, and say
+    how it went.
+
+    An `adaptive` rate starts at `rate` and stays between `min_rate` and
+    `max_rate`, which is `rate` unless given.
+    """
+    # Imported here as the scraper logs its start on import
+    from fetcher import Fetcher, RateLimiter
+    from parsing import ParserPool
+    from scraper import Scraper, root_url
+    from session import Session
+
+    session = Session(
+        pool_size=concurrency, retries=retries, backoff=backoff, proxy=server.url
+    )
+    if adaptive:
+        limiter = RateLimiter(
+            rate,
+            adaptive=True,
+            min_rate=min_rate,
+            max_rate=rate if max_rate is None else max_rate,
+        )
+    else:
+        limiter = RateLimiter(rate)
+
+    requests_before = server.requests
+    records = 0
+    start = time.time()
+    with ParserPool(parse_processes) as parser, \
+            Fetcher(concurrency, session=session, limiter=limiter,
+                    retries=retries, backoff=backoff) as fetcher:
+        for data in Scraper(fetcher, parser=parser).run(root_url):
+            records += 1
+    wall = time.time() - start
+
+    return {
+        'records': records,
+        'requests': server.requests - requests_before,
+        'wall_seconds': wall,
+        'records_per_sec': records / wall if wall else float('inf'),
+        # Where the company pages' rate ended up, having adapted or not
+        'final_rate': limiter.bucket(INDEX_URL % 0).rate,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        'peak_worker_rss_mb': (
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+        ),
+    }
+
+
+def report(results):
+    return '\n'.join([
+        '%-20s %12d' % ('records', results['records']),
+        '%-20s %12d' % ('requests', results['requests']),
+        '%-20s %12.2f' % ('wall seconds', results['wall_seconds']),
+        '%-20s %12.1f' % ('records/sec', results['records_per_sec']),
+        '%-20s %12.2f' % ('final rate', results['final_rate']),
+        '%-20s %12.1f' % ('peak MB', results['peak_rss_mb']),
+        '%-20s %12.1f' % ('peak worker MB', results['peak_worker_rss_mb']),
+    ])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--companies', type=int, default=1000)
+    parser.add_argument(
+        '--overlap', type=int, default=5,
+        help='list every Nth company under two categories (0: none)',
+    )
+    parser.add_argument(
+        '--renamed', type=int, default=3,
+        help='link every Nth company to a history of name changes (0: none)',
+    )
+    parser.add_argument(
+        '--no-redirects', dest='redirects', action='store_false',
+        help='serve the company indexes straight from the main index links',
+    )
+    parser.add_argument('--latency', type=float, default=0, help='seconds per response')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of 503s')
+    parser.add_argument('--retry-after', type=int, help='Retry-After to send with 503s')
+    parser.add_argument('--slow-rate', type=float, default=0, help='fraction of slow responses')
+    parser.add_argument('--slow-latency', type=float, default=5.0, help='seconds a slow response takes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--serve', action='store_true', help='only serve the site')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=1000.0)
+    parser.add_argument('--adaptive', action='store_true', help='adapt the rate as the scraper does')
+    parser.add_argument('--min-rate', type=float, default=0.25, help='slowest an adaptive rate goes')
+    parser.add_argument('--max-rate', type=float, help='fastest an adaptive rate goes (default: --rate)')
+    parser.add_argument('--parse-processes', type=int, default=None)
+    parser.add_argument('--save', help='write the results to this file')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    site = ReplaySite(
+        args.companies,
+        overlap=args.overlap,
+        redirects=args.redirects,
+        renamed=args.renamed,
+    )
+    server = ReplayServer(
+        site,
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+    if args.serve:
+        print 'Serving %d companies as a proxy on %s' % (args.companies, server.url)
+        server.serve_forever()
+
+    with server:
+        results = run_pipeline(
+            server,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            adaptive=args.adaptive,
+            min_rate=args.min_rate,
+            max_rate=args.max_rate,
+            parse_processes=args.parse_processes,
+        )
+
+    print report(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,116 @@
+import sqlite3
+
+
+class RecrawlSchedule(object):
+    """
+    Which runs each company is next worth fetching on, going by how often
+    its record has changed before.
+
+    Intervals are counted in runs, not time, so the schedule keeps step
+    with however often the scraper is run. Each time a company is checked
+    its interval is adjusted: multiplied by `growth` if its record came out
+    the same, up to `max_interval`, or by `shrink` if it changed. A company
+    whose interval falls below `min_interval` is checked on every run, as
+    are companies not seen before.
+
+    Every `full_sweep` runs one checks every company regardless, in case a
+    quiet one has changed after all.
+
+    A run calls `start` before asking what's `due`, and `finish` once it has
+    checked everything it's going to; a run that's resumed after a crash is
+    still the same run. Without `autocommit`, changes are only saved by
+    `commit`.
+    """
+    def __init__(self, path, min_interval=1, max_interval=6, growth=2.0,
+                 shrink=0.25, full_sweep=12, autocommit=True):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.growth = growth
+        self.shrink = shrink
+        self.full_sweep = full_sweep
+        self.autocommit = autocommit
+        self.sweeping = False
+        self._db = sqlite3.connect(path)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS companies (
+                cno TEXT PRIMARY KEY,
+                checks INTEGER NOT NULL,
+                changes INTEGER NOT NULL,
+                interval REAL NOT NULL,
+                checked INTEGER NOT NULL,
+                due REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS runs (
+                run INTEGER PRIMARY KEY,
+                sweep INTEGER NOT NULL
+            );
+        ''')
+        self._db.commit()
+        self._run = self._runs()
+
+    def _runs(self):
+        return self._db.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def start(self):
+        """
+        Begin a run, which is a full sweep if the last one finished enough
+        runs ago.
+        """
+        self._run = self._runs()
+        last, = self._db.execute('SELECT MAX(run) FROM runs WHERE sweep').fetchone()
+        self.sweeping = last is None or self._run - last >= self.full_sweep
+        return self.sweeping
+
+    def due(self, cno):
+        """Whether the company should be fetched on this run"""
+        if self.sweeping:
+            return True
+        row = self._db.execute(
+            'SELECT due FROM companies WHERE cno = ?', (cno,)
+        ).fetchone()
+        return row is None or row[0] <= self._run
+
+    def checked(self, cno, changed):
+        """Note that the company was fetched, and whether its record had changed"""
+        row = self._db.execute(
+            'SELECT checks, changes, interval FROM companies WHERE cno = ?', (cno,)
+        ).fetchone()
+        checks, changes, interval = row or (0, 0, 0)
+
+        if changed:
+            changes += 1
+            interval *= self.shrink
+            if interval < self.min_interval:
+                interval = 0
+        else:
+            interval = min(max(interval * self.growth, self.min_interval),
+                           self.max_interval)
+
+        self._db.execute(
+            'INSERT OR REPLACE INTO companies VALUES (?, ?, ?, ?, ?, ?)',
+            (cno, checks + 1, changes, interval, self._run, self._run + interval)
+        )
+        if self.autocommit:
+            self._db.commit()
+
+    def stats(self, cno):
+        """How many times the company has been checked and changed, and its interval"""
+        row = self._db.execute(
+            'SELECT checks, changes, interval FROM companies WHERE cno = ?', (cno,)
+        ).fetchone()
+        if row:
+            return dict(zip(('checks', 'changes', 'interval'), row))
+
+    def finish(self):
+        """End the run, recording whether it was a full sweep"""
+        self._db.execute('INSERT INTO runs VALUES (?, ?)', (self._run, self.sweeping))
+        self.sweeping = False
+        self._run += 1
+        if self.autocommit:
+            self._db.commit()
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
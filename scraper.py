@@ -1,83 +1,788 @@
 # -*- coding: utf-8 -*-
 
-import json
+import argparse
+import os
 import re
-import time
+import socket
+import urllib
+from collections import OrderedDict, deque
 from datetime import datetime
+from urlparse import parse_qsl, urljoin, urlsplit, urlunsplit
 
+import requests
 import turbotlib
-from pyquery import PyQuery as pq
-
 
+from cache import ResponseCache, normalize_url
+from changes import diff_records
+from checkpoint import Checkpoint
+from columnar import export
 from company_index import CompanyIndex
-from company_page import CompanyPage
-from company_name_change_page import CompanyNameChangePage
+from company_page import find_name_change_link
+from fetcher import Fetcher, RateLimiter
+from lookup import build as build_lookup, load as load_lookup, update as update_lookup
 from main_index import MainIndex
+from metrics import NO_METRICS, Metrics
+from output import Outputs
+from parsing import Finished, ParserPool
+from redirects import RedirectCache
+from session import Session
+from schedule import RecrawlSchedule
+from state import StateStore, page_hash
+from utils import company_id
+from workqueue import SharedRateLimiter, WorkQueue, crawl
 
 turbotlib.log("Starting run...")
 
 
-def find_js_redirect(doc):
-    scripts = doc('script')
-    for script in scripts:
-        if script.text:
-            m = re.match(r"document.location\s*=\s*'(?P<url>http://.+)'", script.text)
-            if m:
-                return m.group('url')
+JS_REDIRECT = re.compile(
+    r"<script\b[^>]*>document.location\s*=\s*'(?P<url>http://[^']+)'",
+    re.IGNORECASE
+)
+
+
+def find_js_redirect(page):
+    """
+    Where a page sends the browser with a script that starts by setting
+    document.location. Looks straight at the raw page, without parsing it.
+    """
+    m = JS_REDIRECT.search(page)
+    if m:
+        return m.group('url')
 
 
 root_url = 'http://www.sec.or.th/EN/MarketProfessionals/Intermediaries/Pages/ListofBusinessOperators.aspx'
 
 
-def wait():
-    time.sleep(0.5)
+def canonical_company_url(url):
+    """
+    One URL for each company page, however the index spelled it: normalized,
+    and without the `flag` parameter some listings add.
+    """
+    parts = urlsplit(normalize_url(url))
+    query = [
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name != 'flag'
+    ]
+    return urlunsplit(parts._replace(query=urllib.urlencode(query)))
 
-if __name__ == '__main__':
-    processed_urls = set()
 
-    turbotlib.log('Scraping main index %s' % root_url)
-    for link in MainIndex(pq(url=root_url)).links:
-        # Redirect if necessary
-        url = link['url']
+def name_change_url(company_url):
+    return re.sub(
+        r'/resultc_\d+.php\?cno=(?P<id>\d+)',
+        lambda m: '/showcomphist.php?cno=' + m.group('id'),
+        company_url
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--concurrency', type=int, default=4,
+        help='number of pages to fetch at once',
+    )
+    parser.add_argument(
+        '--rate', type=float, default=2.0,
+        help='requests per second to any one host to start at',
+    )
+    parser.add_argument(
+        '--min-rate', type=float, default=0.25,
+        help='fewest requests per second to slow down to when a server struggles',
+    )
+    parser.add_argument(
+        '--max-rate', type=float, default=8.0,
+        help='most requests per second to speed up to while a server copes',
+    )
+    parser.add_argument(
+        '--slow', type=float, default=5.0,
+        help='seconds a response can take before we slow down',
+    )
+    parser.add_argument(
+        '--fixed-rate', dest='adaptive', action='store_false',
+        help='keep to --rate, however the server copes',
+    )
+    parser.add_argument(
+        '--timeout', type=float, default=30,
+        help='seconds to wait for a response before giving up',
+    )
+    parser.add_argument(
+        '--retries', type=int, default=3,
+        help='times to retry a failed request, with exponential backoff',
+    )
+    parser.add_argument(
+        '--proxy',
+        help='fetch every page through this HTTP proxy, such as replay.py --serve',
+    )
+    parser.add_argument(
+        '--cache-dir', default=os.path.join(turbotlib.data_dir(), 'http_cache'),
+        help='where to keep fetched pages between runs',
+    )
+    parser.add_argument(
+        '--cache-size', type=int, default=500,
+        help='megabytes of pages to keep before evicting the least recently used',
+    )
+    parser.add_argument(
+        '--no-cache', dest='cache', action='store_false',
+        help='always download pages in full',
+    )
+    parser.add_argument(
+        '--offline', action='store_true',
+        help='replay a previous run entirely from the cache',
+    )
+    parser.add_argument(
+        '--verify-name-changes', action='store_true',
+        help='fetch every company\'s name change history, even those whose '
+             'page has no link to one',
+    )
+    parser.add_argument(
+        '--redirects', default=os.path.join(turbotlib.data_dir(), 'redirects.sqlite'),
+        help='where to remember the redirects from the main index between runs',
+    )
+    parser.add_argument(
+        '--redirect-age', type=float, default=7,
+        help='days to trust a remembered redirect before looking it up again',
+    )
+    parser.add_argument(
+        '--state', default=os.path.join(turbotlib.data_dir(), 'state.sqlite'),
+        help='database of what each company looked like on the last run',
+    )
+    parser.add_argument(
+        '--changes-only', action='store_true',
+        help='only emit companies whose pages changed since the last run',
+    )
+    parser.add_argument(
+        '--reparse', action='store_true',
+        help='parse every company again, even if its pages are unchanged',
+    )
+    parser.add_argument(
+        '--schedule', action='store_true',
+        help='only fetch the companies due a recrawl, by how often each has '
+             'changed, re-emitting the rest as last seen',
+    )
+    parser.add_argument(
+        '--schedule-db', default=os.path.join(turbotlib.data_dir(), 'schedule.sqlite'),
+        help='where to keep track of how often each company changes',
+    )
+    parser.add_argument(
+        '--max-interval', type=int, default=6,
+        help='most runs to go without fetching a company on the schedule',
+    )
+    parser.add_argument(
+        '--full-sweep', type=int, default=12,
+        help='runs between those that fetch every company, schedule or not',
+    )
+    parser.add_argument(
+        '--checkpoint', default=os.path.join(turbotlib.data_dir(), 'checkpoint.sqlite'),
+        help='where to record progress so an interrupted run can resume',
+    )
+    parser.add_argument(
+        '--restart', action='store_true',
+        help='abandon any interrupted run and start again from the main index',
+    )
+    parser.add_argument(
+        '--queue',
+        help='share the crawl with other workers through the work queue here, '
+             'on a volume they can all reach',
+    )
+    parser.add_argument(
+        '--coordinate', action='store_true',
+        help='queue the companies for the other workers, work alongside them, '
+             'and write out every record at the end',
+    )
+    parser.add_argument(
+        '--worker', default='%s:%d' % (socket.gethostname(), os.getpid()),
+        help='name of this worker in the queue',
+    )
+    parser.add_argument(
+        '--lease', type=float, default=600,
+        help='seconds a worker has to scrape the companies it takes on, '
+             'before they go to another',
+    )
+    parser.add_argument(
+        '--lease-size', type=int, default=20,
+        help='companies a worker takes on at a time',
+    )
+    parser.add_argument(
+        '--max-attempts', type=int, default=3,
+        help='times a company is leased out before the crawl gives up on it',
+    )
+    parser.add_argument(
+        '--parse-processes', type=int, default=None,
+        help='worker processes for parsing pages (default: one per CPU; '
+             '0 parses in the main process)',
+    )
+    parser.add_argument(
+        '--parse-queue', type=int, default=16,
+        help='most companies to have waiting on the parser at once',
+    )
+    parser.add_argument(
+        '--output',
+        help='file to write records to (default: stdout); '
+             'a .gz or .zst extension compresses it',
+    )
+    parser.add_argument(
+        '--compression', choices=['gzip', 'zstd'],
+        help='compress the output files',
+    )
+    parser.add_argument(
+        '--changes',
+        help='file to write what changed for each company since the last run to; '
+             'a .gz or .zst extension compresses it',
+    )
+    parser.add_argument(
+        '--no-records', dest='records', action='store_false',
+        help='only write changes, not full records',
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=100,
+        help='records to buffer before writing them out',
+    )
+    parser.add_argument(
+        '--flush-interval', type=float, default=5.0,
+        help='most seconds to hold records before writing them out',
+    )
+    parser.add_argument(
+        '--columnar', metavar='DIR',
+        help='once the output file is finished, also export its licenses, '
+             'shareholders, executives and fund managers to Parquet files here',
+    )
+    parser.add_argument(
+        '--lookup', metavar='PATH',
+        help='once the output file is finished, also load it into a store here '
+             'for looking companies up by name, license or executive; with '
+             '--changes-only, the changed companies are updated in it',
+    )
+    parser.add_argument(
+        '--metrics', action='store_true',
+        help='measure fetching and parsing, and log a summary at the end',
+    )
+    parser.add_argument(
+        '--metrics-file',
+        help='write the measurements here too: as JSON for a .json file, '
+             'otherwise in Prometheus text format',
+    )
+    parser.add_argument(
+        '--trace', action='store_true',
+        help='keep every page fetch individually in the JSON metrics',
+    )
+    args = parser.parse_args(argv)
+    if args.columnar and not (args.output and args.records):
+        parser.error('--columnar needs records written to --output')
+    if args.lookup and not (args.output and args.records):
+        parser.error('--lookup needs records written to --output')
+    if not args.records and not args.changes:
+        parser.error('--no-records needs --changes')
+    if args.coordinate and not args.queue:
+        parser.error('--coordinate needs --queue')
+    if args.queue and (args.changes or args.changes_only or args.schedule):
+        parser.error('--queue can\'t be used with --changes, --changes-only '
+                     'or --schedule')
+    return args
+
+
+class CompanyRecord(object):
+    """
+    A company's record, which may still be being parsed.
+
+    `get()` waits for it and gives the record, or None if the company is to
+    be left out. `on_parsed` is called with a freshly parsed record, on the
+    thread that asked for it, after which `parsed` is set. `previous` is the
+    company's record from the last run, to compare a freshly parsed one with.
+    `fetched` is False for a record taken from the state store without
+    fetching the company's pages at all.
+    """
+    def __init__(self, job, on_parsed=None, previous=None, fetched=True):
+        self._job = job
+        self._on_parsed = on_parsed
+        self.parsed = False
+        self.previous = previous
+        self.fetched = fetched
+
+    def ready(self):
+        return self._job.ready()
+
+    def get(self):
+        data = self._job.get()
+        if self._on_parsed:
+            self._on_parsed(data)
+            self._on_parsed = None
+            self.parsed = True
+        return data
+
+
+class Scraper(object):
+    """
+    Walks the main index down to every company and yields a record for each.
+
+    With a `state` store, companies whose pages are unchanged since the last
+    run are re-emitted from the store rather than parsed again, or left out
+    altogether if `changes_only` is set. `reparse` parses everything anyway,
+    refreshing the store.
+
+    With a `checkpoint`, progress is recorded as companies are emitted, and
+    an interrupted run carries on from where it stopped.
+
+    Pages are parsed by `parser`, a ParserPool, which defaults to parsing in
+    this process.
+
+    With a `state` store, `on_change` is called with what changed for each
+    company since the last run: those that are new, modified or no longer
+    listed. After `run`, `listed` holds the `cno` of every company listed.
+
+    Time spent parsing index pages goes to `metrics`.
+
+    Where each link from the main index redirects to is kept in
+    `redirects`, a RedirectCache, if there is one.
+
+    A company's name change history is only fetched if its page links to
+    it, unless `verify_name_changes` is set.
+
+    With a `schedule`, a RecrawlSchedule, only the companies it says are
+    due are fetched; the rest are re-emitted from the state store as they
+    were last seen.
+    """
+    def __init__(self, fetcher, state=None, changes_only=False, reparse=False,
+                 checkpoint=None, parser=None, max_parsing=16, on_change=None,
+                 metrics=None, redirects=None, verify_name_changes=False,
+                 schedule=None):
+        if on_change and not state:
+            raise ValueError('finding changes needs a state store')
+        if schedule and not state:
+            raise ValueError('a recrawl schedule needs a state store')
+        self.fetcher = fetcher
+        self.metrics = metrics or NO_METRICS
+        self.redirects = redirects
+        self.on_change = on_change
+        self.parser = parser or ParserPool(processes=0)
+        self.max_parsing = max_parsing
+        self.state = state
+        self.changes_only = changes_only
+        self.reparse = reparse
+        self.checkpoint = checkpoint
+        self.verify_name_changes = verify_name_changes
+        self.schedule = schedule
+        if checkpoint:
+            self.processed = checkpoint.completed_companies()
+        else:
+            self.processed = set()
+        self.listed = set()
+
+    def company_indexes(self, url):
+        """Every company index in the run, as (position, link) pairs"""
+        if self.checkpoint:
+            indexes = self.checkpoint.indexes()
+            if indexes:
+                turbotlib.log('Resuming run with %d company indexes to go' % len(
+                    self.checkpoint.pending_indexes()
+                ))
+                return indexes
+
+        turbotlib.log('Scraping main index %s' % url)
+        page = self.fetcher.fetch(url)
+        with self.metrics.timer('parse_seconds', page='main_index'):
+            links = list(MainIndex(page).links)
+        if self.checkpoint:
+            return self.checkpoint.start(links)
+        return list(enumerate(links))
+
+    def run(self, url):
+        if self.schedule and self.schedule.start():
+            turbotlib.log('Checking every company in a full sweep')
+        indexes = self.company_indexes(url)
+        companies = self.find_companies(indexes)
+        self.listed = set(companies)
+
+        # Each company is scraped along with the index it was first found on
+        by_index = {}
+        for company in companies.values():
+            by_index.setdefault(company['position'], []).append(company)
+
+        for position, link in indexes:
+            for data in self.scrape_companies(by_index.get(position, [])):
+                yield data
+            if self.checkpoint:
+                self.checkpoint.complete_index(position)
+
+        if self.on_change:
+            self.remove_unlisted(companies)
+
+        if self.schedule:
+            self.schedule.finish()
+
+        if self.checkpoint:
+            self.checkpoint.finish()
+
+    def remove_unlisted(self, listed):
+        """Report and forget the companies we didn't come across this run"""
+        for cno in self.state.companies():
+            if cno not in listed:
+                self.on_change({
+                    'company_id': cno,
+                    'change': 'removed',
+                    'sample_date': datetime.now().isoformat(),
+                    'changes': diff_records(self.state.record(cno), None),
+                })
+                self.state.remove(cno)
+
+    def resolve_redirect(self, url):
+        """
+        Where a link from the main index really leads, and that page if it
+        had to be fetched to find out.
+        """
+        if self.redirects:
+            target = self.redirects.get(url)
+            if target:
+                return target, None
 
         turbotlib.log('Redirecting from %s' % url)
-        url = find_js_redirect(pq(url=url)) or url
+        page = self.fetcher.fetch(url)
+        with self.metrics.timer('parse_seconds', page='redirect'):
+            target = find_js_redirect(page) or url
+        if self.redirects:
+            self.redirects.put(url, target)
+        return target, page if target == url else None
+
+    def company_links(self, link, retry=True):
+        """The links to companies on a company index"""
+        url, page = self.resolve_redirect(link['url'])
 
-        wait()
         turbotlib.log('Scraping company index %s' % url)
-        company_index = CompanyIndex(
-            pq(url=url),
-            title=link['title'],
-            parents=link['parents'],
-        )
+        if page is None:
+            try:
+                page = self.fetcher.fetch(url)
+            except requests.HTTPError:
+                if not (retry and self.redirects):
+                    raise
+                # The redirect may have moved since we last looked
+                self.redirects.forget(link['url'])
+                return self.company_links(link, retry=False)
+        with self.metrics.timer('parse_seconds', page='company_index'):
+            return filter(None, CompanyIndex(
+                page,
+                title=link['title'],
+                parents=link['parents'],
+            ).links)
+
+    def find_companies(self, indexes):
+        """
+        Every company listed on the company indexes, by cno. A company listed
+        in several categories, under whatever URL, is found once, with the
+        position of the index it was first found on and every category.
+        """
+        companies = OrderedDict()
+        for position, link in indexes:
+            category = {'title': link['title'], 'parents': link['parents']}
+            for company_link in self.company_links(link):
+                url = canonical_company_url(company_link['url'])
+                cno = company_id(url) or url
+                company = companies.setdefault(cno, {
+                    'cno': cno,
+                    'url': url,
+                    'name': company_link['name'],
+                    'position': position,
+                    'categories': [],
+                })
+                if category not in company['categories']:
+                    company['categories'].append(category)
+        return companies
+
+    def scrape_companies(self, companies):
+        # Queue up every company before waiting on any of them, so that the
+        # pool always has work in flight.
+        pending = []
+        for company in companies:
+            if company['cno'] in self.processed:
+                continue
+            self.processed.add(company['cno'])
 
-        for company_link in filter(None, company_index.links):
-            company_url = company_link['url'].replace("&flag=HD", "")
-            if company_url in processed_urls:
+            record = self.unscheduled_record(company['cno'])
+            if record:
+                pending.append((company, None, record))
                 continue
 
-            wait()
-            turbotlib.log('Scraping company page %s' % company_url)
-            page = CompanyPage(pq(url=company_url))
-            data = page.data
+            turbotlib.log('Scraping company page %s' % company['url'])
+            pending.append((
+                company,
+                self.fetcher.submit_followed(
+                    company['url'], self.name_change_follower(company['url'])
+                ),
+                None,
+            ))
+
+        # Hand pages to the parser as they arrive, keeping up to
+        # `max_parsing` companies in the parser at once, and emit records in
+        # index order as they come back.
+        parsing = deque()
+        for company, pages, record in pending:
+            if record is None:
+                company_page, name_change_page = pages.get()
+                record = self.scrape_company(
+                    company['url'], company_page, name_change_page
+                )
+            parsing.append((company, record))
+            while parsing and (
+                len(parsing) > self.max_parsing or parsing[0][1].ready()
+            ):
+                for data in self.emit(*parsing.popleft()):
+                    yield data
+
+        while parsing:
+            for data in self.emit(*parsing.popleft()):
+                yield data
+
+    def unscheduled_record(self, cno):
+        """
+        The stored record for a company that isn't due to be fetched on this
+        run, as a CompanyRecord, or None if it should be fetched.
+        """
+        if not self.schedule or self.schedule.due(cno):
+            return
+        data = self.state.record(cno)
+        if data is None:
+            return
+        turbotlib.log('Company %s is not due to be fetched' % cno)
+        self.metrics.observe('companies', 1, outcome='not_due')
+        return CompanyRecord(
+            Finished(None if self.changes_only else data), fetched=False
+        )
+
+    def name_change_follower(self, company_url):
+        """
+        Given the company's page, says where its name change history is:
+        where the page links to, if it does, else nowhere unless verifying.
+        """
+        def follow(company_page):
+            link = find_name_change_link(company_page)
+            if link:
+                link = urljoin(company_url, link)
+            elif self.verify_name_changes:
+                link = name_change_url(company_url)
+            if link:
+                turbotlib.log('Scraping company name change page %s' % link)
+            return link
+        return follow
+
+    def emit(self, company, record):
+        data = record.get()
+        changes = None
+        if (self.on_change or self.schedule) and record.parsed:
+            changes = diff_records(record.previous, data)
 
-            data['name'] = company_link['name']
+        if data is not None:
+            data['name'] = company['name']
+            data['categories'] = company['categories']
             data['sample_date'] = datetime.now().isoformat()
-            data['source_url'] = company_url
-            processed_urls.add(company_url)
+            data['source_url'] = company['url']
+            if changes and self.on_change:
+                self.on_change({
+                    'company_id': company['cno'],
+                    'change': 'modified' if record.previous else 'added',
+                    'name': data['name'],
+                    'sample_date': data['sample_date'],
+                    'source_url': company['url'],
+                    'changes': changes,
+                })
+
+        # Marked done before the record is handed over, so that the output
+        # flush that writes it out also saves it as done
+        if self.schedule and record.fetched:
+            self.schedule.checked(
+                company['cno'], bool(changes) and record.previous is not None
+            )
+        if self.checkpoint:
+            self.checkpoint.complete_company(company['cno'])
+
+        if data is not None:
+            yield data
+
+    def scrape_company(self, company_url, company_page, name_change_page):
+        """
+        Start turning a company's pages into a record, returning a
+        CompanyRecord for it.
+        """
+        cno = company_id(company_url) or company_url
+        hashes = page_hash(company_page), page_hash(name_change_page)
+
+        if self.state and not self.reparse:
+            data = self.state.unchanged_record(cno, *hashes)
+            if data is not None:
+                turbotlib.log('Company %s is unchanged' % cno)
+                self.metrics.observe('companies', 1, outcome='unchanged')
+                return CompanyRecord(Finished(None if self.changes_only else data))
+
+        on_parsed = None
+        previous = None
+        if self.state:
+            on_parsed = lambda data: self.state.put(cno, hashes[0], hashes[1], data)
+            if self.on_change or self.schedule:
+                previous = self.state.record(cno)
+        self.metrics.observe('companies', 1, outcome='parsed')
+        return CompanyRecord(
+            self.parser.submit(company_page, name_change_page),
+            on_parsed=on_parsed,
+            previous=previous,
+        )
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    metrics = None
+    if args.metrics or args.metrics_file:
+        metrics = Metrics(trace=args.trace)
+
+    cache = None
+    if args.cache or args.offline:
+        cache = ResponseCache(args.cache_dir, max_size=args.cache_size * 1024 * 1024)
+
+    session = Session(
+        pool_size=args.concurrency,
+        timeout=args.timeout,
+        retries=args.retries,
+        cache=cache,
+        offline=args.offline,
+        metrics=metrics,
+        proxy=args.proxy,
+    )
+    if args.adaptive:
+        limiter = RateLimiter(
+            args.rate,
+            adaptive=True,
+            min_rate=args.min_rate,
+            max_rate=args.max_rate,
+            slow=args.slow,
+        )
+    else:
+        limiter = RateLimiter(args.rate)
+    queue = None
+    if args.queue:
+        queue = WorkQueue(args.queue, lease=args.lease, max_attempts=args.max_attempts)
+        if args.coordinate and args.restart:
+            queue.reset()
+        # One rate limit for all the workers together
+        limiter = SharedRateLimiter(
+            args.queue,
+            args.rate,
+            adaptive=args.adaptive,
+            min_rate=args.min_rate,
+            max_rate=args.max_rate,
+            slow=args.slow,
+        )
+    redirects = RedirectCache(args.redirects, max_age=args.redirect_age * 24 * 60 * 60)
+    state = StateStore(args.state, autocommit=False)
+    schedule = None
+    if args.schedule:
+        schedule = RecrawlSchedule(
+            args.schedule_db,
+            max_interval=args.max_interval,
+            full_sweep=args.full_sweep,
+            autocommit=False,
+        )
+
+    checkpoint = Checkpoint(args.checkpoint, autocommit=False)
+    if args.restart:
+        checkpoint.finish()
+    resume_from = None
+    if not queue and checkpoint.pending_indexes():
+        resume_from = checkpoint.output_offsets()
+
+    def log_parked(companies):
+        turbotlib.log('Gave up on %d companies: %s' % (
+            len(companies), ', '.join(company['cno'] for company in companies)
+        ))
 
-            name_change_link = re.sub(
-                r'/resultc_\d+.php\?cno=(?P<id>\d+)',
-                lambda m: '/showcomphist.php?cno=' + m.group('id'),
-                company_url
+    def save_progress(offsets):
+        state.commit()
+        if schedule:
+            schedule.commit()
+        checkpoint.commit(offsets)
+
+    # Progress is saved each time the output is flushed, so that a resumed
+    # run neither loses nor repeats records or changes
+    streams = []
+    if args.records and (args.coordinate or not queue):
+        streams.append(('records', args.output))
+    if args.changes:
+        streams.append(('changes', args.changes))
+    outputs = Outputs(
+        streams,
+        compression=args.compression,
+        batch_size=args.batch_size,
+        flush_interval=args.flush_interval,
+        on_flush=save_progress,
+        resume_from=resume_from,
+    )
+
+    try:
+        with ParserPool(args.parse_processes, metrics=metrics) as parser, \
+                Fetcher(args.concurrency, session=session, metrics=metrics,
+                        limiter=limiter, retries=args.retries) as fetcher, \
+                outputs:
+            changes = outputs.get('changes')
+            scraper = Scraper(
+                fetcher,
+                state=state,
+                changes_only=args.changes_only,
+                reparse=args.reparse,
+                checkpoint=None if queue else checkpoint,
+                parser=parser,
+                max_parsing=args.parse_queue,
+                on_change=changes.write if changes else None,
+                metrics=metrics,
+                redirects=redirects,
+                verify_name_changes=args.verify_name_changes,
+                schedule=schedule,
             )
+            records = outputs.get('records')
+            if queue:
+                # Records go back to the queue rather than to the output, so
+                # the state is saved as each one does
+                scraped = crawl(
+                    queue, scraper, root_url, args.worker,
+                    coordinate=args.coordinate, size=args.lease_size,
+                    on_complete=state.commit, on_parked=log_parked,
+                )
+            else:
+                scraped = scraper.run(root_url)
+            for data in scraped:
+                if records:
+                    records.write(data)
+    finally:
+        # Most wanted when a run goes wrong
+        if metrics:
+            turbotlib.log('Metrics:\n' + metrics.summary())
+            if args.metrics_file:
+                metrics.dump(args.metrics_file)
 
-            wait()
-            turbotlib.log('Scraping company name change page %s' % name_change_link)
-            page = CompanyNameChangePage(pq(url=name_change_link))
-            data['old_names'] = page.old_names
+    redirects.close()
+    if queue:
+        queue.close()
+        limiter.close()
+    if schedule:
+        schedule.close()
+    checkpoint.close()
 
-            print json.dumps(data)
+    if args.columnar:
+        # Exported from the finished file rather than as records arrive, so
+        # that it covers a resumed run from the start
+        turbotlib.log('Exporting to %s' % args.columnar)
+        export(args.output, args.columnar)
+
+    if args.lookup:
+        turbotlib.log('Loading records into %s' % args.lookup)
+        if not args.changes_only:
+            build_lookup(args.output, args.lookup)
+        elif os.path.exists(args.lookup):
+            # The rest are unchanged since they were last loaded
+            update_lookup(args.output, args.lookup, scraper.listed)
+        else:
+            # Only the changed companies were written out; every listed
+            # company's last record is in the state store
+            load_lookup(
+                filter(None, (state.record(cno) for cno in sorted(scraper.listed))),
+                args.lookup,
+            )
+    state.close()
 
 
 #html = open('data/ListofBusinessOperators.aspx').read()
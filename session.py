@@ -0,0 +1,115 @@
+import time
+from urlparse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from cache import CacheMiss
+from metrics import NO_METRICS
+
+
+class Session(object):
+    """
+    One keep-alive connection pool shared by every page fetch.
+
+    `get` returns the raw response body, ready to hand to the page classes;
+    lxml picks the character set out of the page itself.
+
+    With a `cache`, pages seen before are revalidated with a conditional
+    request and served from disk if the server answers 304 Not Modified.
+    An `offline` session never touches the network and serves everything
+    from the cache, raising CacheMiss for anything it has not seen.
+
+    Failed connections are retried up to `retries` times, backing off
+    exponentially by `backoff`. Error responses are raised as they are, for
+    the Fetcher to retry in step with its rate limiter.
+
+    Every response's latency, size, status and retries go to `metrics`. A
+    response's retries are those urllib3 made for it, plus one if it's the
+    Fetcher's `attempt` at retrying an error response, so they add up to
+    every retry made.
+    With a `proxy`, every request goes through it.
+    """
+    HEADERS = {
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    }
+
+    def __init__(self, pool_size=4, timeout=30, retries=3, backoff=0.5,
+                 cache=None, offline=False, metrics=None, proxy=None):
+        if offline and not cache:
+            raise ValueError('An offline session needs a cache')
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        self.metrics = metrics or NO_METRICS
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, backoff_factor=backoff),
+        )
+        self._session = requests.Session()
+        self._session.headers.update(self.HEADERS)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        if proxy:
+            self._session.proxies = {'http': proxy, 'https': proxy}
+
+    def get(self, url, attempt=0):
+        cached = self.cache.get(url) if self.cache else None
+        if self.offline:
+            if cached is None:
+                raise CacheMiss(url)
+            return cached.body
+
+        start = time.time()
+        response = self._session.get(
+            url,
+            headers=cached.validators if cached else {},
+            timeout=self.timeout,
+        )
+        if self.metrics.enabled:
+            self._measure(url, response, time.time() - start, attempt)
+        if cached and response.status_code == 304:
+            return cached.body
+
+        response.raise_for_status()
+        if self.cache:
+            self.cache.put(
+                url,
+                response.content,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+            )
+        return response.content
+
+    def _measure(self, url, response, seconds, attempt):
+        host = urlsplit(url).netloc.lower()
+        size = len(response.content)
+        retries = response.raw.retries
+        retries = len(retries.history) if retries else 0
+        if attempt:
+            retries += 1
+
+        self.metrics.observe(
+            'fetch_seconds', seconds, host=host, status=response.status_code
+        )
+        self.metrics.observe(
+            'fetch_bytes', size, host=host, status=response.status_code
+        )
+        self.metrics.observe('fetch_retries', retries, host=host)
+        self.metrics.trace(
+            url=url,
+            seconds=seconds,
+            bytes=size,
+            status=response.status_code,
+            retries=retries,
+            attempt=attempt,
+        )
+
+    def close(self):
+        self._session.close()
+        if self.cache:
+            self.cache.close()
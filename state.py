@@ -0,0 +1,102 @@
+import hashlib
+import json
+import sqlite3
+from datetime import datetime
+
+
+def page_hash(body):
+    return hashlib.sha1(body or '').hexdigest()
+
+
+class StateStore(object):
+    """
+    What we saw for each company on previous runs.
+
+    Keyed by the company's `cno` id, it remembers hashes of the company and
+    name change pages along with the record we emitted for them, so that a
+    company whose pages haven't changed needn't be parsed again.
+
+    Records that are replaced or removed are kept in its history, so there's
+    a snapshot of every version of each company.
+
+    Without `autocommit`, changes are only saved by `commit`.
+    """
+    def __init__(self, path, autocommit=True):
+        self.autocommit = autocommit
+        self._db = sqlite3.connect(path)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS companies (
+                cno TEXT PRIMARY KEY,
+                page_hash TEXT NOT NULL,
+                name_change_hash TEXT NOT NULL,
+                record TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS history (
+                cno TEXT NOT NULL,
+                replaced TEXT NOT NULL,
+                record TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS history_cno ON history (cno);
+        ''')
+        self._db.commit()
+
+    def unchanged_record(self, cno, page_hash, name_change_hash):
+        """The last record for this company, if neither page has changed"""
+        row = self._db.execute(
+            'SELECT record FROM companies '
+            'WHERE cno = ? AND page_hash = ? AND name_change_hash = ?',
+            (cno, page_hash, name_change_hash)
+        ).fetchone()
+        if row:
+            return json.loads(row[0])
+
+    def record(self, cno):
+        """The last record for this company, whatever its pages are now"""
+        row = self._db.execute(
+            'SELECT record FROM companies WHERE cno = ?', (cno,)
+        ).fetchone()
+        if row:
+            return json.loads(row[0])
+
+    def companies(self):
+        return [cno for (cno,) in self._db.execute('SELECT cno FROM companies')]
+
+    def history(self, cno):
+        """Earlier records for this company, oldest first, as (replaced, record)"""
+        return [
+            (replaced, json.loads(record))
+            for replaced, record in self._db.execute(
+                'SELECT replaced, record FROM history WHERE cno = ? ORDER BY rowid',
+                (cno,)
+            )
+        ]
+
+    def _archive(self, cno, record):
+        """Move the company's current record, if it differs, into its history"""
+        self._db.execute('''
+            INSERT INTO history
+            SELECT cno, ?, record FROM companies WHERE cno = ? AND record IS NOT ?
+        ''', (datetime.now().isoformat(), cno, record))
+
+    def put(self, cno, page_hash, name_change_hash, record):
+        record = json.dumps(record, sort_keys=True)
+        self._archive(cno, record)
+        self._db.execute(
+            'INSERT OR REPLACE INTO companies VALUES (?, ?, ?, ?)',
+            (cno, page_hash, name_change_hash, record)
+        )
+        if self.autocommit:
+            self._db.commit()
+
+    def remove(self, cno):
+        """Forget a company that's no longer listed, keeping its history"""
+        self._archive(cno, None)
+        self._db.execute('DELETE FROM companies WHERE cno = ?', (cno,))
+        if self.autocommit:
+            self._db.commit()
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
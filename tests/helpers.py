@@ -0,0 +1,34 @@
+"""Stand-ins shared by the tests"""
+from parsing import parse_company
+
+
+class Clock(object):
+    """
+    A clock the tests move on by hand, or by sleeping on it. With a `tick`,
+    it also moves on by that much each time it's read.
+    """
+    def __init__(self, now=0.0, tick=0):
+        self.now = now
+        self.tick = tick
+        self.sleeps = []
+
+    def __call__(self):
+        self.now += self.tick
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def company_record(cno, **fields):
+    """The fixture company's record, as the company `cno`, with any `fields` changed"""
+    data = parse_company(
+        open('data/company.html').read(), open('data/namechange.html').read()
+    )
+    data['source_url'] = (
+        'http://capital.sec.or.th/webapp/en/infocenter/intermed/comprofile/'
+        'resultc_29032549.php?cno=%s' % cno
+    )
+    data.update(fields)
+    return data
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+from benchmark import fixture, regressions, scaled_page
+from company_index import CompanyIndex
+from company_page import CompanyPage
+
+
+def test_scaled_company_index():
+    html = scaled_page(
+        fixture('COMPANYPROFILE03.aspx'),
+        r'<tr class="rg(?:Alt)?Row"[^>]*>(?:(?!<tr).)*?</tr>',
+        500,
+    )
+    links = filter(None, CompanyIndex(html, title='', parents=[]).links)
+    assert len(links) == 500
+
+
+def test_scaled_company_page_keeps_its_encoding():
+    html = scaled_page(
+        fixture('company.html'),
+        r'<tr><td>\d+\.</td>(?:<td>[^<]*</td>){3}</tr>',
+        25,
+    )
+    data = CompanyPage(html).data
+    assert len(data['executives']) == 25
+    assert data['licenses'][0]['number'] == u'ลก-0061-01'
+
+
+def test_regressions():
+    baseline = {'a': {'latency_ms': 10.0}, 'b': {'latency_ms': 10.0}}
+    results = {
+        'a': {'latency_ms': 11.0},
+        'b': {'latency_ms': 13.0},
+        'c': {'latency_ms': 100.0},
+    }
+    assert regressions(results, baseline, threshold=0.2) == {'b': 1.3}
@@ -0,0 +1,56 @@
+import os
+
+from cache import ResponseCache, normalize_url
+from tests.helpers import Clock
+
+
+def test_normalize_url():
+    assert normalize_url(
+        'HTTP://Capital.SEC.or.th:80/webapp/showcomphist.php?flag=HD&cno=0000000505#top'
+    ) == 'http://capital.sec.or.th/webapp/showcomphist.php?cno=0000000505&flag=HD'
+
+
+def test_cache_round_trip(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    cache.put('http://www.sec.or.th/a?x=1&y=2', 'body', etag='"abc"',
+              last_modified='Wed, 23 Mar 2016 10:00:00 GMT')
+
+    entry = cache.get('http://www.sec.or.th/a?y=2&x=1')
+    assert entry.body == 'body'
+    assert entry.validators == {
+        'If-None-Match': '"abc"',
+        'If-Modified-Since': 'Wed, 23 Mar 2016 10:00:00 GMT',
+    }
+    assert cache.get('http://www.sec.or.th/b') is None
+
+
+def test_cache_stores_identical_bodies_once(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    cache.put('http://www.sec.or.th/a', 'same')
+    cache.put('http://www.sec.or.th/b', 'same')
+
+    assert cache.size == 4
+    assert len(os.listdir(str(tmpdir.join('bodies')))) == 1
+
+
+def test_cache_evicts_least_recently_used(tmpdir):
+    cache = ResponseCache(str(tmpdir), max_size=10, clock=Clock(tick=1))
+    cache.put('http://www.sec.or.th/a', 'aaaa')
+    cache.put('http://www.sec.or.th/b', 'bbbb')
+    cache.get('http://www.sec.or.th/a')
+    cache.put('http://www.sec.or.th/c', 'cccc')
+
+    assert cache.get('http://www.sec.or.th/a').body == 'aaaa'
+    assert cache.get('http://www.sec.or.th/b') is None
+    assert cache.get('http://www.sec.or.th/c').body == 'cccc'
+    assert cache.size == 8
+
+
+def test_cache_persists_between_runs(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    cache.put('http://www.sec.or.th/a', 'body')
+    cache.close()
+
+    cache = ResponseCache(str(tmpdir))
+    assert cache.get('http://www.sec.or.th/a').body == 'body'
+    assert cache.size == 4
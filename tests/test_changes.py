@@ -0,0 +1,53 @@
+from changes import diff_records, diff_section
+
+
+def test_diff_section_matches_entries_by_key():
+    old = [
+        {'name': 'A', 'percentage': 10.0},
+        {'name': 'B', 'percentage': 20.0},
+    ]
+    new = [
+        {'name': 'B', 'percentage': 25.0},
+        {'name': 'C', 'percentage': 5.0},
+    ]
+    assert diff_section(old, new, ('name',)) == {
+        'added': [{'name': 'C', 'percentage': 5.0}],
+        'removed': [{'name': 'A', 'percentage': 10.0}],
+        'modified': [{
+            'old': {'name': 'B', 'percentage': 20.0},
+            'new': {'name': 'B', 'percentage': 25.0},
+        }],
+    }
+    assert diff_section(old, list(reversed(old)), ('name',)) == {}
+
+
+def test_diff_section_pairs_up_entries_with_the_same_key():
+    old = [{'name': 'A'}]
+    new = [{'name': 'A'}, {'name': 'A'}]
+    assert diff_section(old, new, ('name',)) == {'added': [{'name': 'A'}]}
+
+
+def test_diff_records():
+    old = {
+        'name': 'AEC SECURITIES',
+        'address': 'Bangkok',
+        'executives': [{'name': 'Mr. A', 'position': 'CEO', 'nationality': 'Thai'}],
+        'old_names': [],
+    }
+    new = dict(old, address='Chiang Mai', old_names=[
+        {'name': 'AEC', 'until': '2014-01-31'},
+    ])
+    assert diff_records(old, new) == {
+        'fields': {'address': {'old': 'Bangkok', 'new': 'Chiang Mai'}},
+        'old_names': {'added': [{'name': 'AEC', 'until': '2014-01-31'}]},
+    }
+    assert diff_records(old, dict(old)) == {}
+
+
+def test_diff_records_for_new_and_removed_companies():
+    record = {'name': 'AEC SECURITIES', 'executives': [{'name': 'Mr. A'}]}
+    assert diff_records(None, record) == {
+        'fields': {'name': {'old': None, 'new': 'AEC SECURITIES'}},
+        'executives': {'added': [{'name': 'Mr. A'}]},
+    }
+    assert diff_records(record, None)['executives'] == {'removed': [{'name': 'Mr. A'}]}
@@ -0,0 +1,44 @@
+from checkpoint import Checkpoint
+
+
+def test_checkpoint_survives_restart(tmpdir):
+    path = str(tmpdir.join('checkpoint.sqlite'))
+    links = [
+        {'url': 'http://www.sec.or.th/a', 'title': 'A', 'parents': ['Brokerage']},
+        {'url': 'http://www.sec.or.th/b', 'title': 'B', 'parents': []},
+    ]
+
+    checkpoint = Checkpoint(path)
+    assert checkpoint.pending_indexes() == []
+    assert checkpoint.start(links) == list(enumerate(links))
+    checkpoint.complete_index(0)
+    checkpoint.complete_company('0000000001')
+    checkpoint.close()
+
+    checkpoint = Checkpoint(path)
+    assert checkpoint.pending_indexes() == [(1, links[1])]
+    assert checkpoint.indexes() == list(enumerate(links))
+    assert checkpoint.completed_companies() == set([
+        '0000000001'
+    ])
+
+    checkpoint.finish()
+    assert checkpoint.pending_indexes() == []
+    assert checkpoint.completed_companies() == set()
+
+
+def test_checkpoint_only_saves_progress_on_commit(tmpdir):
+    path = str(tmpdir.join('checkpoint.sqlite'))
+    checkpoint = Checkpoint(path, autocommit=False)
+    checkpoint.start([{'url': 'http://www.sec.or.th/a', 'title': 'A', 'parents': []}])
+
+    checkpoint.complete_company('0000000001')
+    checkpoint.commit({'records': 1234})
+    checkpoint.complete_company('0000000002')
+    checkpoint.close()
+
+    checkpoint = Checkpoint(path)
+    assert checkpoint.completed_companies() == set([
+        '0000000001'
+    ])
+    assert checkpoint.output_offsets() == {'records': 1234}
@@ -0,0 +1,56 @@
+import pytest
+
+from output import RecordWriter
+
+pyarrow = pytest.importorskip('pyarrow')
+import pyarrow.parquet  # noqa
+
+from columnar import TABLES, export
+from tests.helpers import company_record
+
+
+@pytest.fixture
+def exported(tmpdir):
+    path = str(tmpdir.join('records.jsonl.gz'))
+    records = [
+        company_record('0000000505', sample_date='2015-01-01'),
+        company_record('0000000506', sample_date='2015-01-02'),
+    ]
+    with RecordWriter(path, compression='gzip', batch_size=1) as writer:
+        for data in records:
+            writer.write(data)
+
+    directory = str(tmpdir.join('columnar'))
+    export(path, directory, row_group_size=5)
+    return records, directory
+
+
+def test_each_sub_table_gets_a_file(exported):
+    records, directory = exported
+    for table, columns in TABLES:
+        parquet = pyarrow.parquet.read_table('%s/%s.parquet' % (directory, table))
+        assert parquet.num_rows == sum(len(data[table]) for data in records)
+        assert parquet.schema.names == (
+            ['company_id', 'sample_date'] + [name for name, _ in columns]
+        )
+
+
+def test_rows_are_keyed_by_company_and_sample_date(exported):
+    records, directory = exported
+    executives = pyarrow.parquet.read_table(
+        directory + '/executives.parquet', columns=['company_id', 'sample_date', 'name']
+    ).to_pydict()
+
+    expected = [
+        (cno, data['sample_date'], executive['name'])
+        for cno, data in zip(['0000000505', '0000000506'], records)
+        for executive in data['executives']
+    ]
+    assert zip(executives['company_id'], executives['sample_date'], executives['name']) == expected
+
+
+def test_repeated_strings_are_dictionary_encoded(exported):
+    _, directory = exported
+    executives = pyarrow.parquet.read_table(directory + '/executives.parquet')
+    assert pyarrow.types.is_dictionary(executives.schema.field('nationality').type)
+    assert not pyarrow.types.is_dictionary(executives.schema.field('name').type)
@@ -1,13 +1,32 @@
 # -*- coding: utf-8 -*-
 
+import re
 from datetime import date
 
-from company_page import CompanyPage
+import pytest
+from lxml import html as lxml_html
+from pyquery import PyQuery as pq
 
+from company_page import (
+    BACKENDS,
+    INFO_MATCHERS,
+    CompanyPage,
+    InfoMatcher,
+    LxmlBackend,
+    MatcherRegistry,
+    SectionRegistry,
+    css_to_xpath,
+    find_name_change_link,
+)
 
-def test_company_page_basic_data():
+
+backends = pytest.mark.parametrize('backend', sorted(BACKENDS))
+
+
+@backends
+def test_company_page_basic_data(backend):
     html = open('data/company.html').read()
-    data = CompanyPage(html).data
+    data = CompanyPage(html, backend=backend).data
     assert data['name'] == 'AEC SECURITIES PUBLIC COMPANY LIMITED'
     assert data['address'] == (
         '63 , ATHENEE TOWER, 15TH, 17TH FL., WIRELESS RD., '
@@ -21,9 +40,40 @@ def test_company_page_basic_data():
     assert data['paid_up_capital'] == '1,009.74 Million Baht'
 
 
-def test_company_page_licenses():
+@backends
+def test_company_page_name_change_link(backend):
+    html = open('data/company.html').read()
+    page = CompanyPage(html, backend=backend)
+    assert page.name_change_link == 'showcomphist.php?cno=0000000505'
+
+    # A company that has never changed its name
+    html = re.sub(r'<a href=showcomphist\.php[^>]*>[^<]*</a>', '', html)
+    page = CompanyPage(html, backend=backend)
+    assert page.name_change_link is None
+    assert page.data['website'] == 'http://www.aecs.com'
+
+
+def test_css_to_xpath_selects_what_pyquery_does():
+    html = open('data/company.html').read()
+    tree = lxml_html.fromstring(html)
+    for selector in ['td', '.menub .ttr', '.menub tr']:
+        assert css_to_xpath(selector)(tree) == list(pq(tree)(selector))
+
+
+def test_find_name_change_link():
+    assert find_name_change_link(
+        "<a href='showcomphist.php?cno=1' target='_blank'>"
+    ) == 'showcomphist.php?cno=1'
+    assert find_name_change_link("<a href='http://www.aecs.com'>") is None
+    assert find_name_change_link(
+        '<a href="showcomphist.php?cno=1&amp;lang=en">'
+    ) == 'showcomphist.php?cno=1&lang=en'
+
+
+@backends
+def test_company_page_licenses(backend):
     html = open('data/company.html').read()
-    data = CompanyPage(html).data
+    data = CompanyPage(html, backend=backend).data
     for entry in [
         {
             'type': '',
@@ -60,17 +110,19 @@ def test_company_page_licenses():
     ]:
         assert entry in data['licenses']
 
-def test_company_page_shareholders():
+@backends
+def test_company_page_shareholders(backend):
     html = open('data/company.html').read()
-    data = CompanyPage(html).data
+    data = CompanyPage(html, backend=backend).data
     assert data['major_shareholders'] == [{
         'name': 'PRAPHOL MILINDACHINLA',
         'percentage': 25.06,
     }]
 
-def test_company_page_executives():
+@backends
+def test_company_page_executives(backend):
     html = open('data/company.html').read()
-    data = CompanyPage(html).data
+    data = CompanyPage(html, backend=backend).data
     assert len(data['executives']) == 10
 
     for entry in [
@@ -92,9 +144,10 @@ def test_company_page_executives():
     ]:
         assert entry in data['executives']
 
-def test_company_page_fund_managers():
+@backends
+def test_company_page_fund_managers(backend):
     html = open('data/company.html').read()
-    data = CompanyPage(html).data
+    data = CompanyPage(html, backend=backend).data
     assert data['fund_managers'] == [{
         'name': 'MR. ANUPON SRIARD',
         'type': 'mutual',
@@ -103,20 +156,132 @@ def test_company_page_fund_managers():
         'training_deadline': '2017-12-31',
     }]
 
-def test_company_page_head_of_compliance():
+@backends
+def test_company_page_head_of_compliance(backend):
     html = open('data/company.html').read()
-    data = CompanyPage(html).data
+    data = CompanyPage(html, backend=backend).data
     assert data['head_of_compliance'] == [{
         'name': 'MR. KASIDIT NUCHTAN',
         'start_date': '2015-05-06',
     }]
 
-def test_company_page_anti_corruption():
+@backends
+def test_company_page_anti_corruption(backend):
     html = open('data/company.html').read()
-    data = CompanyPage(html).data
+    data = CompanyPage(html, backend=backend).data
     assert data['anti_corruption'] == {
         'rating': '3A',
         'description': 'Established by Declaration of Intent',
         'date': '2016-03-17',
     }
 
+
+
+@pytest.mark.parametrize('filename', [
+    'data/company.html',
+    'data/COMPANYPROFILE03.aspx',
+    'data/namechange.html',
+])
+def test_company_page_backends_agree(filename):
+    html = open(filename).read()
+    assert (
+        CompanyPage(html, backend='lxml').data ==
+        CompanyPage(html, backend='pyquery').data
+    )
+
+
+def test_company_page_data_is_computed_once():
+    page = CompanyPage(open('data/company.html').read())
+    assert page.data is page.data
+
+
+def test_info_matchers_dispatch_like_trying_each_in_turn():
+    for row in LxmlBackend(open('data/company.html').read()).rows:
+        expected = None
+        for matcher in INFO_MATCHERS:
+            expected = matcher.attempt_match(row, row.text)
+            if expected:
+                break
+        assert INFO_MATCHERS.match(row) == expected
+
+
+def test_info_matcher_registry_takes_new_matchers():
+    registry = MatcherRegistry()
+
+    @registry.register
+    class LicenseeMatcher(InfoMatcher):
+        prefix = 'Licensee : '
+        regex = re.compile('Licensee : (?P<name>.+)')
+
+        @staticmethod
+        def process(row, match):
+            return dict(licensee=match.group('name'))
+
+    class Row(object):
+        text = 'Licensee : AEC SECURITIES '
+
+    assert registry.match(Row()) == {'licensee': 'AEC SECURITIES'}
+
+    Row.text = 'Head office 63 , ATHENEE TOWER'
+    assert registry.match(Row()) is None
+
+
+def test_company_page_sections_can_be_added():
+    class AuditedCompanyPage(CompanyPage):
+        SECTIONS = SectionRegistry(CompanyPage.SECTIONS)
+
+    def process_auditor(page, row):
+        cells = row.cells
+        if len(cells) == 2:
+            page._data['auditors'].append({'name': cells[0], 'firm': cells[1]})
+
+    AuditedCompanyPage.SECTIONS.add('auditors', ('Auditors',), process_auditor)
+
+    html = open('data/company.html').read().replace(
+        "<tr class='ttr'><td colspan='4'><b>Executives</b></td></tr>",
+        "<tr class='ttr'><td colspan='4'><b>Auditors</b></td></tr>"
+        "<tr><td>MR. SOMCHAI</td><td>ANY AUDIT CO.</td></tr>"
+        "<tr class='ttr'><td colspan='4'><b>Executives</b></td></tr>",
+    )
+    data = AuditedCompanyPage(html).data
+    assert data['auditors'] == [{'name': 'MR. SOMCHAI', 'firm': 'ANY AUDIT CO.'}]
+    assert len(data['executives']) == 10
+    assert 'auditors' not in CompanyPage(html).data
+
+
+class CountingBackend(LxmlBackend):
+    rows_read = 0
+
+    @property
+    def rows(self):
+        for row in super(CountingBackend, self).rows:
+            CountingBackend.rows_read += 1
+            yield row
+
+
+def test_company_page_parses_only_the_sections_asked_for(monkeypatch):
+    monkeypatch.setitem(BACKENDS, 'counting', CountingBackend)
+    html = open('data/company.html').read()
+    full = CompanyPage(html).data
+
+    CountingBackend.rows_read = 0
+    all_rows = len(list(LxmlBackend(html).rows))
+    page = CompanyPage(html, backend='counting', sections={'basic', 'licenses'})
+    data = page.data
+    assert CountingBackend.rows_read < all_rows
+    assert data['address'] == full['address']
+    assert data['licenses'] == full['licenses']
+    assert 'executives' not in data
+
+    # Anything else is parsed when it's looked up
+    assert data['executives'] == full['executives']
+    assert data.get('fund_managers') == full['fund_managers']
+    assert data == full
+    assert data.get('missing') is None
+    with pytest.raises(KeyError):
+        data['missing']
+
+
+def test_company_page_rejects_unknown_sections():
+    with pytest.raises(ValueError):
+        CompanyPage(open('data/company.html').read(), sections={'auditors'})
@@ -0,0 +1,229 @@
+import pytest
+import requests
+
+from cache import ResponseCache
+from fetcher import (
+    AdaptiveTokenBucket,
+    Fetcher,
+    RateLimiter,
+    TokenBucket,
+    retry_after,
+)
+from metrics import Metrics
+from replay import ReplayServer, ReplaySite
+from scraper import root_url
+from session import Session
+from tests.helpers import Clock
+
+
+def test_token_bucket_paces_requests():
+    clock = Clock()
+    bucket = TokenBucket(rate=2, burst=1, clock=clock, sleep=clock.sleep)
+
+    for _ in range(5):
+        bucket.acquire()
+
+    # first token is free, then one every half second
+    assert clock.now == 2.0
+
+
+def test_token_bucket_allows_burst():
+    clock = Clock()
+    bucket = TokenBucket(rate=1, burst=3, clock=clock, sleep=clock.sleep)
+
+    for _ in range(3):
+        bucket.acquire()
+
+    assert clock.sleeps == []
+
+
+def test_rate_limiter_buckets_per_host():
+    clock = Clock()
+    limiter = RateLimiter(rate=1, clock=clock, sleep=clock.sleep)
+
+    limiter.wait('http://www.sec.or.th/EN/Pages/a.aspx')
+    limiter.wait('http://capital.sec.or.th/webapp/b.php')
+    assert clock.now == 0
+
+    limiter.wait('http://WWW.sec.or.th/EN/Pages/c.aspx')
+    assert clock.now == 1.0
+
+
+class FakeSession(object):
+    closed = False
+    offline = False
+
+    def get(self, url, attempt=0):
+        return url.upper()
+
+    def close(self):
+        self.closed = True
+
+
+def test_fetcher_returns_pages_in_submission_order():
+    session = FakeSession()
+    with Fetcher(concurrency=3, rate=1000, session=session) as fetcher:
+        results = [fetcher.submit('http://example.com/%d' % n) for n in range(10)]
+        assert [r.get() for r in results] == [
+            'HTTP://EXAMPLE.COM/%d' % n for n in range(10)
+        ]
+    assert session.closed
+
+
+def test_fetcher_follows_pages_on_the_same_thread():
+    with Fetcher(concurrency=2, rate=1000, session=FakeSession()) as fetcher:
+        followed = fetcher.submit_followed(
+            'http://example.com/a', lambda page: page.lower() + '/b'
+        )
+        unfollowed = fetcher.submit_followed('http://example.com/c', lambda page: None)
+        assert followed.get() == ('HTTP://EXAMPLE.COM/A', 'HTTP://EXAMPLE.COM/A/B')
+        assert unfollowed.get() == ('HTTP://EXAMPLE.COM/C', None)
+
+
+def adaptive_bucket(clock, **kwargs):
+    return AdaptiveTokenBucket(
+        rate=2, min_rate=0.5, max_rate=4, clock=clock, sleep=clock.sleep, **kwargs
+    )
+
+
+def test_adaptive_bucket_speeds_up_while_responses_are_quick():
+    clock = Clock()
+    bucket = adaptive_bucket(clock)
+
+    for _ in range(100):
+        bucket.succeeded(0.2)
+    assert bucket.rate == 4
+
+
+def test_adaptive_bucket_backs_off_once_per_cooldown():
+    clock = Clock()
+    bucket = adaptive_bucket(clock, cooldown=2.0)
+
+    bucket.failed()
+    bucket.succeeded(10.0)
+    assert bucket.rate == 1.0
+
+    clock.now = 2.0
+    bucket.succeeded(10.0)
+    bucket.failed()
+    assert bucket.rate == 0.5
+
+
+def test_adaptive_bucket_pauses_for_retry_after():
+    clock = Clock()
+    bucket = adaptive_bucket(clock)
+
+    bucket.acquire()
+    bucket.failed(retry_after=30)
+    bucket.acquire()
+    assert clock.now == 30
+
+
+def test_retry_after():
+    class Response(object):
+        def __init__(self, **headers):
+            self.headers = headers
+
+    assert retry_after(Response(**{'Retry-After': '120'})) == 120
+    assert retry_after(Response(**{'Retry-After': 'Thu, 01 Jan 1970 00:00:00 GMT'})) == 0
+    assert retry_after(Response()) is None
+    assert retry_after(None) is None
+
+
+class FlakySession(object):
+    """Fails with 503 and Retry-After, then recovers"""
+    offline = False
+
+    def __init__(self, failures):
+        self.failures = failures
+
+    def get(self, url, attempt=0):
+        if self.failures:
+            self.failures -= 1
+            response = requests.Response()
+            response.status_code = 503
+            response.headers['Retry-After'] = '5'
+            raise requests.HTTPError(response=response)
+        return 'page'
+
+    def close(self):
+        pass
+
+
+class RecordingLimiter(RateLimiter):
+    def __init__(self):
+        RateLimiter.__init__(self, rate=1000)
+        self.feedback = []
+
+    def succeeded(self, url, seconds):
+        self.feedback.append('succeeded')
+
+    def failed(self, url, retry_after=None):
+        self.feedback.append(('failed', retry_after))
+
+
+def test_fetcher_tells_the_limiter_how_requests_went():
+    limiter = RecordingLimiter()
+    with Fetcher(concurrency=1, session=FlakySession(1), limiter=limiter,
+                 retries=0) as fetcher:
+        with pytest.raises(requests.HTTPError):
+            fetcher.fetch('http://www.sec.or.th/')
+        assert fetcher.fetch('http://www.sec.or.th/') == 'page'
+    assert limiter.feedback == [('failed', 5), 'succeeded']
+
+
+def test_fetcher_retries_in_step_with_the_limiter():
+    clock = Clock()
+    limiter = RecordingLimiter()
+    with Fetcher(concurrency=1, session=FlakySession(2), limiter=limiter,
+                 retries=2, sleep=clock.sleep) as fetcher:
+        assert fetcher.fetch('http://www.sec.or.th/') == 'page'
+    assert limiter.feedback == [('failed', 5), ('failed', 5), 'succeeded']
+    assert clock.sleeps == [5, 5]
+
+
+def test_limiter_hears_of_every_error_from_a_real_session():
+    site = ReplaySite(companies=1)
+    limiter = RecordingLimiter()
+    with ReplayServer(site, error_rate=0.4, seed=1) as server:
+        session = Session(pool_size=1, proxy=server.url)
+        with Fetcher(concurrency=1, session=session, limiter=limiter,
+                     retries=10, backoff=0) as fetcher:
+            for _ in range(20):
+                fetcher.fetch(root_url)
+    assert server.errors > 0
+    assert limiter.feedback.count(('failed', None)) == server.errors
+    assert limiter.feedback.count('succeeded') == 20
+
+
+def test_offline_fetches_skip_the_limiter(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    cache.put(root_url, 'cached page')
+    clock = Clock()
+    limiter = RecordingLimiter()
+    limiter.wait = lambda url: clock.sleep(1)
+    with Fetcher(concurrency=1, session=Session(cache=cache, offline=True),
+                 limiter=limiter) as fetcher:
+        for _ in range(5):
+            assert fetcher.fetch(root_url) == 'cached page'
+    assert clock.sleeps == []
+    assert limiter.feedback == []
+
+
+def test_retried_errors_are_counted_in_the_metrics():
+    metrics = Metrics(trace=True)
+    with ReplayServer(ReplaySite(companies=1), error_rate=0.5, seed=2) as server:
+        session = Session(pool_size=1, proxy=server.url, metrics=metrics)
+        with Fetcher(concurrency=1, session=session, metrics=metrics,
+                     retries=10, backoff=0) as fetcher:
+            for _ in range(10):
+                fetcher.fetch(root_url)
+    assert server.errors > 0
+
+    retries = sum(
+        summary.total for name, labels, summary in metrics.summaries()
+        if name == 'fetch_retries'
+    )
+    assert retries == server.errors
+    assert sum(trace['retries'] for trace in metrics.traces) == server.errors
+    assert len([trace for trace in metrics.traces if trace['attempt'] == 0]) == 10
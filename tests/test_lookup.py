@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+from lookup import LookupStore, build, update
+from output import RecordWriter
+from tests.helpers import company_record
+
+
+def test_lookup_store_finds_companies_by_name_license_and_executive(tmpdir):
+    records = str(tmpdir.join('records.jsonl.gz'))
+    with RecordWriter(records, compression='gzip', batch_size=1) as writer:
+        writer.write(company_record('0000000505', name='AEC SECURITIES PUBLIC COMPANY LIMITED'))
+        writer.write(company_record('0000000506', name='OTHER SECURITIES COMPANY LIMITED'))
+
+    path = str(tmpdir.join('lookup.sqlite'))
+    build(records, path)
+    store = LookupStore(path)
+
+    def cnos(found):
+        return [data['source_url'][-10:] for data in found]
+
+    assert cnos(store.by_name('aec secur')) == ['0000000505']
+    assert cnos(store.by_name('securities limited')) == ['0000000505', '0000000506']
+    assert cnos(store.by_name('united securites')) == ['0000000505', '0000000506']
+    assert store.by_name('nothing like it') == []
+    assert store.by_name('"*') == []
+
+    assert cnos(store.by_license(u'ส1-0061-01')) == ['0000000505', '0000000506']
+    assert store.by_license('0061') == []
+    assert cnos(store.by_executive('mr. paisit kaenchan')) == ['0000000505', '0000000506']
+    assert store.get('0000000506')['name'] == 'OTHER SECURITIES COMPANY LIMITED'
+
+
+def test_lookup_store_replaces_a_company_added_again(tmpdir):
+    store = LookupStore(str(tmpdir.join('lookup.sqlite')))
+    store.add(company_record('0000000505', name='AEC SECURITIES PUBLIC COMPANY LIMITED'))
+    renamed = company_record('0000000505', name='RENAMED SECURITIES PUBLIC COMPANY LIMITED')
+    renamed['executives'] = []
+    store.add(renamed)
+
+    assert store.by_name('aec') == []
+    assert store.by_name('renamed') == [renamed]
+    assert store.by_executive('MR. PAISIT KAENCHAN') == []
+    assert len(store.by_license(u'ส1-0061-01')) == 1
+
+
+def test_lookup_store_updated_with_only_the_changed_companies(tmpdir):
+    path = str(tmpdir.join('lookup.sqlite'))
+    records = str(tmpdir.join('records.jsonl'))
+    with RecordWriter(records, batch_size=1) as writer:
+        writer.write(company_record('0000000505', name='AEC SECURITIES PUBLIC COMPANY LIMITED'))
+        writer.write(company_record('0000000506', name='OTHER SECURITIES COMPANY LIMITED'))
+    build(records, path)
+
+    changed = str(tmpdir.join('changed.jsonl'))
+    with RecordWriter(changed, batch_size=1) as writer:
+        writer.write(company_record('0000000506', name='RENAMED SECURITIES COMPANY LIMITED'))
+    update(changed, path)
+
+    store = LookupStore(path)
+    assert store.get('0000000505')['name'] == 'AEC SECURITIES PUBLIC COMPANY LIMITED'
+    assert store.get('0000000506')['name'] == 'RENAMED SECURITIES COMPANY LIMITED'
+    assert store.by_name('other') == []
+    store.close()
+
+    # A company no longer listed goes from the store
+    update(changed, path, listed=set(['0000000506']))
+    store = LookupStore(path)
+    assert store.get('0000000505') is None
+    assert store.by_name('aec') == []
+    assert store.by_executive('MR. PAISIT KAENCHAN') == [store.get('0000000506')]
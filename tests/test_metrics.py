@@ -0,0 +1,56 @@
+import json
+
+from metrics import NO_METRICS, Metrics
+
+
+def test_metrics_summarise_observations_by_name_and_labels():
+    metrics = Metrics()
+    metrics.observe('fetch_seconds', 0.5, host='www.sec.or.th', status=200)
+    metrics.observe('fetch_seconds', 1.5, host='www.sec.or.th', status=200)
+    metrics.observe('fetch_seconds', 3.0, host='www.sec.or.th', status=500)
+    with metrics.timer('parse_seconds', page='company'):
+        pass
+
+    [(_, ok), (_, failed), (_, parse)] = [
+        (name, summary) for name, _, summary in metrics.summaries()
+    ]
+    assert (ok.count, ok.total, ok.max) == (2, 2.0, 1.5)
+    assert (failed.count, failed.total) == (1, 3.0)
+    assert parse.count == 1
+
+    assert 'fetch_seconds host=www.sec.or.th status=200' in metrics.summary()
+
+
+def test_metrics_dump_as_prometheus_or_json(tmpdir):
+    metrics = Metrics(trace=True)
+    metrics.observe('section_rows', 10, section='executives')
+    metrics.observe('section_rows', 4, section='executives')
+    metrics.trace(url='http://www.sec.or.th/', status=200)
+
+    prometheus = str(tmpdir.join('metrics.prom'))
+    metrics.dump(prometheus)
+    assert open(prometheus).read() == (
+        '# TYPE turbot_sec_section_rows summary\n'
+        'turbot_sec_section_rows_count{section="executives"} 2\n'
+        'turbot_sec_section_rows_sum{section="executives"} 14.0\n'
+    )
+
+    path = str(tmpdir.join('metrics.json'))
+    metrics.dump(path)
+    assert json.load(open(path)) == {
+        'metrics': [{
+            'name': 'section_rows',
+            'labels': {'section': 'executives'},
+            'count': 2,
+            'sum': 14,
+            'max': 10,
+        }],
+        'traces': [{'url': 'http://www.sec.or.th/', 'status': 200}],
+    }
+
+
+def test_no_metrics_does_nothing():
+    with NO_METRICS.timer('parse_seconds', page='company'):
+        NO_METRICS.observe('fetch_seconds', 1.0)
+        NO_METRICS.trace(url='http://www.sec.or.th/')
+    assert not NO_METRICS.enabled
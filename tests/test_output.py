@@ -0,0 +1,100 @@
+import gzip
+import json
+
+import pytest
+
+from output import Outputs, RecordWriter, compression_for
+from tests.helpers import Clock
+
+
+def read_records(path, opener=open):
+    with opener(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_records_are_written_in_batches(tmpdir):
+    path = str(tmpdir.join('out.jsonl'))
+    offsets = []
+    writer = RecordWriter(path, batch_size=2, on_flush=offsets.append)
+
+    writer.write({'n': 1})
+    assert offsets == []
+    writer.write({'n': 2})
+    assert len(offsets) == 1
+    assert read_records(path + '.partial') == [{'n': 1}, {'n': 2}]
+
+    writer.write({'n': 3})
+    writer.close()
+    assert read_records(path) == [{'n': 1}, {'n': 2}, {'n': 3}]
+    assert not tmpdir.join('out.jsonl.partial').exists()
+
+
+def test_records_are_flushed_after_interval(capsys):
+    clock = Clock()
+    writer = RecordWriter(batch_size=100, flush_interval=5, clock=clock)
+
+    writer.write({'n': 1})
+    assert capsys.readouterr()[0] == ''
+    clock.now = 6
+    writer.write({'n': 2})
+    assert capsys.readouterr()[0] == '{"n": 1}\n{"n": 2}\n'
+
+
+def test_gzip_output_is_readable_after_every_flush(tmpdir):
+    path = str(tmpdir.join('out.jsonl.gz'))
+    writer = RecordWriter(path, compression=compression_for(path), batch_size=2)
+    for n in range(5):
+        writer.write({'n': n})
+    assert read_records(path + '.partial', gzip.open) == [{'n': n} for n in range(4)]
+
+    writer.close()
+    assert read_records(path, gzip.open) == [{'n': n} for n in range(5)]
+
+
+def test_interrupted_output_resumes_from_last_flush(tmpdir):
+    path = str(tmpdir.join('out.jsonl.gz'))
+    offsets = []
+    with pytest.raises(IOError):
+        with RecordWriter(path, compression='gzip', batch_size=2,
+                          on_flush=offsets.append) as writer:
+            for n in range(3):
+                writer.write({'n': n})
+            raise IOError('Connection reset by peer')
+
+    # A crash could leave a half-written batch after the last good flush
+    with open(path + '.partial', 'ab') as f:
+        f.write('\x1f\x8b\x08garbage')
+
+    with RecordWriter(path, compression='gzip', resume_from=offsets[-1]) as writer:
+        writer.write({'n': 3})
+
+    assert read_records(path, gzip.open) == [{'n': n} for n in range(4)]
+
+
+def test_compression_for():
+    assert compression_for('records.jsonl.gz') == 'gzip'
+    assert compression_for('records.jsonl.zst') == 'zstd'
+    assert compression_for('records.jsonl') is None
+    assert compression_for(None) is None
+
+
+def test_outputs_are_flushed_together(tmpdir):
+    records = str(tmpdir.join('records.jsonl'))
+    changes = str(tmpdir.join('changes.jsonl.gz'))
+    offsets = []
+    outputs = Outputs(
+        [('records', records), ('changes', changes)],
+        batch_size=2,
+        on_flush=offsets.append,
+    )
+    outputs.get('changes').write({'change': 'added'})
+    outputs.get('records').write({'n': 1})
+    assert read_records(changes + '.partial', gzip.open) == []
+
+    outputs.get('records').write({'n': 2})
+    assert read_records(changes + '.partial', gzip.open) == [{'change': 'added'}]
+    assert sorted(offsets[-1]) == ['changes', 'records']
+
+    outputs.close()
+    assert read_records(records) == [{'n': 1}, {'n': 2}]
+    assert outputs.get('missing') is None
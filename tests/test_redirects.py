@@ -0,0 +1,30 @@
+from redirects import RedirectCache
+from tests.helpers import Clock
+
+
+URL = 'http://capital.sec.or.th/webapp/en/infocenter/intermed/comprofile/resultl_new.php?lic_no=1&ref_id=345'
+TARGET = 'http://capital.sec.or.th/webapp/en/infocenter/intermed/comprofile/COMPANYPROFILE03.aspx'
+
+
+def test_redirect_cache_remembers_targets_between_runs(tmpdir):
+    path = str(tmpdir.join('redirects.sqlite'))
+    cache = RedirectCache(path)
+    assert cache.get(URL) is None
+    cache.put(URL, TARGET)
+    cache.close()
+
+    cache = RedirectCache(path)
+    assert cache.get(URL) == TARGET
+    cache.forget(URL)
+    assert cache.get(URL) is None
+
+
+def test_redirect_cache_looks_again_after_max_age(tmpdir):
+    clock = Clock(1000.0)
+    cache = RedirectCache(str(tmpdir.join('redirects.sqlite')), max_age=60, clock=clock)
+    cache.put(URL, TARGET)
+
+    clock.now += 60
+    assert cache.get(URL) == TARGET
+    clock.now += 1
+    assert cache.get(URL) is None
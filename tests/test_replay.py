@@ -0,0 +1,71 @@
+import requests
+
+from company_index import CompanyIndex
+from company_page import CompanyPage
+from main_index import MainIndex
+from replay import INDEX_URL, ReplayServer, ReplaySite, run_pipeline
+from scraper import find_js_redirect, root_url
+
+
+COMPANY_URL = 'http://capital.sec.or.th/webapp/en/infocenter/intermed/comprofile/resultc_29032549.php?cno=%s'
+
+
+def test_replay_site_lists_generated_companies():
+    site = ReplaySite(companies=100)
+    assert site.page('http://example.com/nowhere') is None
+
+    listed = set()
+    for position in site.listings:
+        links = filter(None, CompanyIndex(site.page(INDEX_URL % position), '', []).links)
+        assert [link['url'] for link in links] == [COMPANY_URL % cno for cno in site.listings[position]]
+        listed.update(site.listings[position])
+    assert listed == set(site.cnos)
+
+    page = CompanyPage(site.page(COMPANY_URL % site.cnos[7]))
+    assert page.data['name'] == 'REPLAY SECURITIES 0000000008 COMPANY LIMITED'
+    assert site.page(COMPANY_URL % '9999999999') is None
+
+
+def test_replay_site_redirects_from_the_main_index():
+    site = ReplaySite(companies=10)
+    main_index = site.page(root_url)
+    assert find_js_redirect(main_index) is None
+
+    url = next(MainIndex(main_index).links)['url']
+    assert find_js_redirect(site.page(url)) == INDEX_URL % 0
+    assert ReplaySite(companies=10, redirects=False).page(url) == site.index_page(0)
+
+
+def test_replay_server_injects_errors():
+    with ReplayServer(ReplaySite(companies=1), error_rate=1, retry_after=3) as server:
+        proxies = {'http': server.url}
+        response = requests.get(root_url, proxies=proxies)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '3'
+        assert server.errors == 1
+
+
+def test_whole_pipeline_against_replay_server():
+    site = ReplaySite(companies=60)
+    links = list(MainIndex(site.main_index).links)
+    with ReplayServer(site) as server:
+        results = run_pipeline(server, concurrency=4, parse_processes=1)
+    assert results['records'] == 60
+    # The main index, each category link and where it leads, each company's
+    # page and, for every third company, its name change history
+    assert results['requests'] == 1 + 2 * len(links) + 60 + 20
+    assert results['records_per_sec'] > 0
+
+
+def test_adaptive_pipeline_keeps_to_the_rates_given():
+    with ReplayServer(ReplaySite(companies=10)) as server:
+        results = run_pipeline(server, concurrency=4, rate=100.0, adaptive=True,
+                               parse_processes=0)
+    assert results['records'] == 10
+    # Not held to the scraper's default ceiling of 8 a second
+    assert results['final_rate'] == 100.0
+
+    with ReplayServer(ReplaySite(companies=10)) as server:
+        results = run_pipeline(server, concurrency=4, rate=20.0, adaptive=True,
+                               max_rate=50.0, parse_processes=0)
+    assert 20.0 < results['final_rate'] <= 50.0
@@ -0,0 +1,70 @@
+from schedule import RecrawlSchedule
+
+
+def test_schedule_backs_off_quiet_companies_and_keeps_up_with_busy_ones(tmpdir):
+    schedule = RecrawlSchedule(str(tmpdir.join('schedule.sqlite')))
+    schedule.start()
+    schedule.checked('quiet', changed=False)
+    schedule.checked('busy', changed=False)
+    schedule.finish()
+
+    for run in range(1, 4):
+        assert not schedule.start()
+        assert schedule.due('busy')
+        assert schedule.due('new')
+        if schedule.due('quiet'):
+            schedule.checked('quiet', changed=False)
+        schedule.checked('busy', changed=True)
+        schedule.finish()
+
+    # Checked on the first, second and fourth runs
+    assert schedule.stats('quiet') == {'checks': 3, 'changes': 0, 'interval': 4}
+    assert schedule.stats('busy') == {'checks': 4, 'changes': 3, 'interval': 0}
+    schedule.start()
+    assert not schedule.due('quiet')
+
+
+def test_schedule_sweeps_everything_now_and_then(tmpdir):
+    path = str(tmpdir.join('schedule.sqlite'))
+    schedule = RecrawlSchedule(path, max_interval=2, full_sweep=4)
+    assert schedule.start()
+    for n in range(5):
+        schedule.checked('quiet', changed=False)
+    schedule.finish()
+    schedule.close()
+
+    schedule = RecrawlSchedule(path, max_interval=2, full_sweep=4)
+    assert not schedule.start()
+    assert not schedule.due('quiet')
+    schedule.finish()
+
+    for run in range(2):
+        schedule.start()
+        schedule.finish()
+    assert schedule.start()
+    assert schedule.due('quiet')
+
+    # Until a sweep finishes, the next run sweeps too
+    assert schedule.start()
+    schedule.finish()
+    assert not schedule.start()
+
+
+def test_monthly_runs_skip_quiet_companies(tmpdir):
+    schedule = RecrawlSchedule(str(tmpdir.join('schedule.sqlite')))
+    checks = {'quiet': [], 'busy': []}
+
+    # A year of monthly runs, as the bot is run
+    for month in range(12):
+        schedule.start()
+        for cno in checks:
+            if schedule.due(cno):
+                checks[cno].append(month)
+                schedule.checked(cno, changed=cno == 'busy' and month > 0)
+        schedule.finish()
+
+    assert checks['busy'] == range(12)
+    assert checks['quiet'] == [0, 1, 3, 7]
+
+    # Then a full sweep checks it again
+    assert schedule.start()
@@ -0,0 +1,327 @@
+import re
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+import parsing
+from checkpoint import Checkpoint
+from parsing import ParserPool
+from output import Outputs, read_records
+from redirects import RedirectCache
+from main_index import MainIndex
+from metrics import Metrics
+from scraper import (
+    Scraper,
+    canonical_company_url,
+    company_id,
+    find_js_redirect,
+    name_change_url,
+    root_url,
+)
+from schedule import RecrawlSchedule
+from state import StateStore
+
+
+class FixtureFetcher(object):
+    """Answers every request with the matching page from data/"""
+
+    def __init__(self, fail_after=None):
+        self.urls = []
+        self.fail_after = fail_after
+        self._pool = ThreadPool(1)
+
+    def fetch(self, url):
+        self.urls.append(url)
+        if self.fail_after is not None and len(self.urls) > self.fail_after:
+            raise IOError('Connection reset by peer')
+        if 'ListofBusinessOperators' in url:
+            return open('data/ListofBusinessOperators.aspx').read()
+        if 'showcomphist' in url:
+            return open('data/namechange.html').read()
+        if 'resultc_' in url:
+            return open('data/company.html').read()
+        return open('data/COMPANYPROFILE03.aspx').read()
+
+    def submit(self, url):
+        return self._pool.apply_async(self.fetch, (url,))
+
+    def fetch_followed(self, url, follow):
+        page = self.fetch(url)
+        followed_url = follow(page)
+        return page, self.fetch(followed_url) if followed_url else None
+
+    def submit_followed(self, url, follow):
+        return self._pool.apply_async(self.fetch_followed, (url, follow))
+
+
+COMPANY_URL = 'http://capital.sec.or.th/webapp/en/infocenter/intermed/comprofile/resultc_29032549.php?cno=0000000505'
+
+
+def test_company_id():
+    assert company_id(COMPANY_URL) == '0000000505'
+    assert company_id('http://www.sec.or.th/EN/Pages/Home.aspx') is None
+
+
+def test_name_change_url():
+    assert name_change_url(COMPANY_URL) == (
+        'http://capital.sec.or.th/webapp/en/infocenter/intermed/comprofile/showcomphist.php?cno=0000000505'
+    )
+
+
+def test_find_js_redirect():
+    page = (
+        "<html><head><SCRIPT type='text/javascript'>"
+        "document.location = 'http://capital.sec.or.th/webapp/resultl_new.php?lic_no=1'"
+        "</SCRIPT></head></html>"
+    )
+    assert find_js_redirect(page) == 'http://capital.sec.or.th/webapp/resultl_new.php?lic_no=1'
+    assert find_js_redirect(open('data/company.html').read()) is None
+
+
+class RedirectingFetcher(FixtureFetcher):
+    """Every link from the main index redirects to the real company index"""
+
+    def fetch(self, url):
+        if 'redirected' in url or 'ListofBusiness' in url or 'cno=' in url:
+            return super(RedirectingFetcher, self).fetch(url)
+        self.urls.append(url)
+        return "<script>document.location='%s&redirected=1'</script>" % url
+
+
+def test_run_remembers_redirects(tmpdir):
+    redirects = RedirectCache(str(tmpdir.join('redirects.sqlite')))
+
+    first = RedirectingFetcher()
+    assert len(list(Scraper(first, redirects=redirects).run(root_url))) == 42
+    assert len([url for url in first.urls if 'redirected' in url]) == 18
+
+    again = RedirectingFetcher()
+    assert len(list(Scraper(again, redirects=redirects).run(root_url))) == 42
+    index_urls = [url for url in again.urls if 'cno=' not in url]
+    assert len(index_urls) == 19
+    assert all('redirected' in url for url in index_urls[1:])
+
+
+def test_canonical_company_url():
+    assert canonical_company_url(COMPANY_URL + '&flag=HD') == COMPANY_URL
+    assert canonical_company_url(
+        'HTTP://Capital.sec.or.th:80/webapp/resultc_1.php?flag=HD&cno=0000000505#top'
+    ) == 'http://capital.sec.or.th/webapp/resultc_1.php?cno=0000000505'
+
+
+def test_run_fetches_each_company_once_with_all_its_categories():
+    fetcher = FixtureFetcher()
+    records = list(Scraper(fetcher).run(root_url))
+
+    # Every index in the fixtures lists the same companies
+    links = MainIndex(open('data/ListofBusinessOperators.aspx').read()).links
+    categories = []
+    for link in links:
+        category = {'title': link['title'], 'parents': link['parents']}
+        if category not in categories:
+            categories.append(category)
+
+    assert len(records) == 42
+    assert all(data['categories'] == categories for data in records)
+    assert len([url for url in fetcher.urls if 'resultc_' in url]) == 42
+    assert len([url for url in fetcher.urls if 'showcomphist' in url]) == 42
+
+
+class HistorylessFetcher(FixtureFetcher):
+    """No company has ever changed its name, so none links to its history"""
+
+    def fetch(self, url):
+        page = super(HistorylessFetcher, self).fetch(url)
+        if 'resultc_' in url:
+            page = re.sub(r'<a href=showcomphist\.php[^>]*>[^<]*</a>', '', page)
+        return page
+
+
+def test_run_fetches_name_change_history_only_when_linked():
+    fetcher = HistorylessFetcher()
+    records = list(Scraper(fetcher).run(root_url))
+    assert len(records) == 42
+    assert all(data['old_names'] == [] for data in records)
+    assert not [url for url in fetcher.urls if 'showcomphist' in url]
+
+    fetcher = HistorylessFetcher()
+    records = list(Scraper(fetcher, verify_name_changes=True).run(root_url))
+    assert len([url for url in fetcher.urls if 'showcomphist' in url]) == 42
+    assert all(data['old_names'] for data in records)
+
+
+def test_scrape_company_reuses_unchanged_records(tmpdir, monkeypatch):
+    company_page = open('data/company.html').read()
+    name_change_page = open('data/namechange.html').read()
+    store = StateStore(str(tmpdir.join('state.sqlite')))
+
+    first = Scraper(None, state=store).scrape_company(
+        COMPANY_URL, company_page, name_change_page
+    ).get()
+    assert first['name'] == 'AEC SECURITIES PUBLIC COMPANY LIMITED'
+    assert len(first['old_names']) == 2
+
+    def not_parsed(html):
+        raise AssertionError('unchanged page was parsed again')
+    monkeypatch.setattr(parsing, 'CompanyPage', not_parsed)
+
+    again = Scraper(None, state=store)
+    assert again.scrape_company(
+        COMPANY_URL, company_page, name_change_page
+    ).get() == first
+
+    changes_only = Scraper(None, state=store, changes_only=True)
+    assert changes_only.scrape_company(
+        COMPANY_URL, company_page, name_change_page
+    ).get() is None
+
+    monkeypatch.undo()
+    assert changes_only.scrape_company(
+        COMPANY_URL, company_page + ' ', name_change_page
+    ).get() == first
+
+
+def test_interrupted_run_resumes_without_duplicates(tmpdir):
+    path = str(tmpdir.join('checkpoint.sqlite'))
+
+    # Fail part way through the companies, after the 19 index pages
+    first = []
+    run = Scraper(FixtureFetcher(fail_after=60), checkpoint=Checkpoint(path))
+    with pytest.raises(IOError):
+        for data in run.run(root_url):
+            first.append(data)
+    assert first
+
+    fetcher = FixtureFetcher()
+    rest = list(Scraper(fetcher, checkpoint=Checkpoint(path)).run(root_url))
+
+    urls = [data['source_url'] for data in first + rest]
+    assert len(urls) == len(set(urls)) == 42
+    assert root_url not in fetcher.urls
+    assert Checkpoint(path).pending_indexes() == []
+
+
+def test_interrupted_run_resumes_its_output_without_duplicates(tmpdir):
+    path = str(tmpdir.join('checkpoint.sqlite'))
+    output = str(tmpdir.join('records.jsonl'))
+
+    def run(die_after=None):
+        # As the scraper runs: progress is only saved as output is flushed
+        checkpoint = Checkpoint(path, autocommit=False)
+        resume_from = None
+        if checkpoint.pending_indexes():
+            resume_from = checkpoint.output_offsets()
+        outputs = Outputs(
+            [('records', output)], batch_size=5, flush_interval=None,
+            on_flush=checkpoint.commit, resume_from=resume_from,
+        )
+        records = outputs.get('records')
+        scraper = Scraper(FixtureFetcher(), checkpoint=checkpoint)
+        for n, data in enumerate(scraper.run(root_url), 1):
+            records.write(data)
+            if n == die_after:
+                # Nothing more is written out or saved
+                checkpoint.close()
+                return
+        outputs.close()
+        checkpoint.close()
+
+    run(die_after=10)
+    run()
+
+    urls = [data['source_url'] for data in read_records(output)]
+    assert len(urls) == len(set(urls)) == 42
+
+
+def test_run_parses_in_worker_processes():
+    inline = list(Scraper(FixtureFetcher()).run(root_url))
+    with ParserPool(processes=2) as parser:
+        pooled = list(Scraper(FixtureFetcher(), parser=parser, max_parsing=4).run(root_url))
+
+    def strip_sample_date(records):
+        return [dict(data, sample_date=None) for data in records]
+
+    assert strip_sample_date(pooled) == strip_sample_date(inline)
+
+
+class PromotingFetcher(FixtureFetcher):
+    """Company 0000000505's manager has been promoted"""
+
+    def fetch(self, url):
+        page = super(PromotingFetcher, self).fetch(url)
+        if url.endswith('resultc_29032549.php?cno=0000000505'):
+            page = page.replace(
+                '<td>MRS. AMPORN JIAMMUNJIT</td><td>Manager</td>',
+                '<td>MRS. AMPORN JIAMMUNJIT</td><td>Managing Director</td>',
+            )
+        return page
+
+
+def test_run_reports_changes_since_last_run(tmpdir):
+    store = StateStore(str(tmpdir.join('state.sqlite')))
+
+    first = []
+    list(Scraper(FixtureFetcher(), state=store, on_change=first.append).run(root_url))
+    assert len(first) == 42
+    assert set(change['change'] for change in first) == set(['added'])
+
+    store.put('0000009999', 'page', 'names', {'name': 'GONE SECURITIES'})
+    second = []
+    records = list(Scraper(
+        PromotingFetcher(), state=store, on_change=second.append
+    ).run(root_url))
+    assert len(records) == 42
+
+    modified, removed = second
+    assert modified['company_id'] == '0000000505'
+    assert modified['change'] == 'modified'
+    assert modified['changes'] == {'executives': {'modified': [{
+        'old': {'name': 'MRS. AMPORN JIAMMUNJIT', 'position': 'Manager', 'nationality': 'THAI'},
+        'new': {'name': 'MRS. AMPORN JIAMMUNJIT', 'position': 'Managing Director', 'nationality': 'THAI'},
+    }]}}
+    assert removed['company_id'] == '0000009999'
+    assert removed['change'] == 'removed'
+    assert store.record('0000009999') is None
+
+
+def test_run_measures_parsing():
+    metrics = Metrics()
+    parser = ParserPool(processes=0, metrics=metrics)
+    records = list(Scraper(FixtureFetcher(), parser=parser, metrics=metrics).run(root_url))
+
+    summaries = dict(
+        ((name, tuple(labels.values())), summary)
+        for name, labels, summary in metrics.summaries()
+    )
+    assert summaries['parse_seconds', ('main_index',)].count == 1
+    assert summaries['parse_seconds', ('company_index',)].count == 18
+    assert summaries['parse_seconds', ('company',)].count == len(records) == 42
+    assert summaries['section_rows', ('executives',)].total == 42 * 10
+    assert summaries['companies', ('parsed',)].count == 42
+
+
+def test_run_only_fetches_companies_due_on_the_schedule(tmpdir):
+    state = StateStore(str(tmpdir.join('state.sqlite')))
+    schedule = RecrawlSchedule(str(tmpdir.join('schedule.sqlite')))
+
+    def run(fetcher):
+        records = list(Scraper(fetcher, state=state, schedule=schedule).run(root_url))
+        assert len(records) == 42
+        return [url for url in fetcher.urls if 'resultc_' in url]
+
+    # The first run sweeps everything, and the next checks each company
+    # again; then none is due for a run
+    assert len(run(FixtureFetcher())) == 42
+    assert len(run(FixtureFetcher())) == 42
+    assert run(FixtureFetcher()) == []
+
+    # A company that changes is checked more often than the rest
+    assert len(run(PromotingFetcher())) == 42
+    assert run(PromotingFetcher()) == [COMPANY_URL]
+
+
+def test_run_notes_every_company_listed():
+    scraper = Scraper(FixtureFetcher())
+    assert len(list(scraper.run(root_url))) == 42
+    assert len(scraper.listed) == 42
+    assert '0000000505' in scraper.listed
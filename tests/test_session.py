@@ -0,0 +1,113 @@
+import gzip
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from StringIO import StringIO
+
+import pytest
+
+from cache import CacheMiss, ResponseCache
+from metrics import Metrics
+from session import Session
+
+
+def gzipped(body):
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(body)
+    return buf.getvalue()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    body = '<html><body>hello</body></html>'
+    etag = '"v1"'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        payload = gzipped(self.body)
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.connections = 0
+    server.requests = []
+    server.url = 'http://127.0.0.1:%d/page' % server.server_port
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def test_session_reuses_connection_and_decompresses(server):
+    session = Session(timeout=5)
+    pages = [session.get(server.url) for _ in range(3)]
+    session.close()
+
+    assert pages == [Handler.body] * 3
+    assert server.connections == 1
+    assert 'gzip' in server.requests[0]['accept-encoding']
+
+
+def test_session_revalidates_cached_pages(server, tmpdir):
+    session = Session(timeout=5, cache=ResponseCache(str(tmpdir)))
+    first = session.get(server.url)
+    second = session.get(server.url)
+    session.close()
+
+    assert first == second == Handler.body
+    assert 'if-none-match' not in server.requests[0]
+    assert server.requests[1]['if-none-match'] == Handler.etag
+
+
+def test_offline_session_replays_from_cache(server, tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    cache.put(server.url, 'cached page')
+    session = Session(cache=cache, offline=True)
+
+    assert session.get(server.url) == 'cached page'
+    with pytest.raises(CacheMiss):
+        session.get(server.url + '?other')
+    assert server.requests == []
+
+
+def test_session_measures_each_response(server, tmpdir):
+    metrics = Metrics(trace=True)
+    session = Session(timeout=5, cache=ResponseCache(str(tmpdir)), metrics=metrics)
+    session.get(server.url)
+    session.get(server.url)
+    session.close()
+
+    host = '127.0.0.1:%d' % server.server_port
+    summaries = dict(
+        ((name, labels.get('status')), summary)
+        for name, labels, summary in metrics.summaries()
+    )
+    assert summaries['fetch_seconds', 200].count == 1
+    assert summaries['fetch_seconds', 304].count == 1
+    assert summaries['fetch_bytes', 200].total == len(Handler.body)
+    assert summaries['fetch_retries', None].total == 0
+    assert [(trace['url'], trace['status']) for trace in metrics.traces] == [
+        (server.url, 200), (server.url, 304),
+    ]
+    assert all(labels['host'] == host for _, labels, _ in metrics.summaries())
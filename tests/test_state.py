@@ -0,0 +1,45 @@
+from state import StateStore, page_hash
+
+
+def test_state_store_returns_record_for_unchanged_pages(tmpdir):
+    store = StateStore(str(tmpdir.join('state.sqlite')))
+    record = {'name': u'AEC SECURITIES PUBLIC COMPANY LIMITED', 'old_names': []}
+    store.put('0000000505', page_hash('page'), page_hash('names'), record)
+
+    assert store.unchanged_record(
+        '0000000505', page_hash('page'), page_hash('names')
+    ) == record
+    assert store.unchanged_record(
+        '0000000505', page_hash('new page'), page_hash('names')
+    ) is None
+    assert store.unchanged_record(
+        '0000005026', page_hash('page'), page_hash('names')
+    ) is None
+
+
+def test_state_store_keeps_history_of_replaced_records(tmpdir):
+    store = StateStore(str(tmpdir.join('state.sqlite')))
+    first = {'name': u'AEC SECURITIES', 'old_names': []}
+    second = {'name': u'AEC SECURITIES', 'old_names': [{'name': u'AEC'}]}
+
+    store.put('0000000505', page_hash('page'), page_hash('names'), first)
+    store.put('0000000505', page_hash('page'), page_hash('names'), first)
+    store.put('0000000505', page_hash('page'), page_hash('new names'), second)
+    assert store.record('0000000505') == second
+    assert [record for _, record in store.history('0000000505')] == [first]
+
+    store.remove('0000000505')
+    assert store.record('0000000505') is None
+    assert store.companies() == []
+    assert [record for _, record in store.history('0000000505')] == [first, second]
+
+
+def test_state_store_only_saves_on_commit(tmpdir):
+    path = str(tmpdir.join('state.sqlite'))
+    store = StateStore(path, autocommit=False)
+    store.put('0000000505', page_hash('page'), page_hash('names'), {})
+    store.commit()
+    store.put('0000005026', page_hash('page'), page_hash('names'), {})
+    store.close()
+
+    assert StateStore(path).companies() == ['0000000505']
@@ -0,0 +1,48 @@
+import pytest
+from dateutil.parser import parse
+
+from utils import iso_date, lru_cache, quick_parse_date
+
+
+def dateutil_iso_date(text):
+    try:
+        return parse(text, dayfirst=True).date().isoformat()
+    except ValueError:
+        return ''
+
+
+@pytest.mark.parametrize('text', [
+    '31/01/2014',
+    '1/2/2014',
+    ' 06/05/2015 ',
+    '05/13/2014',
+    '31/02/2014',
+    'Dec 15, 1993',
+    'december 15, 1993',
+    'Sept 5, 2001',
+    '15 Dec 1993',
+    '2016-03-17',
+    '',
+    ' ',
+])
+def test_iso_date_matches_dateutil(text):
+    assert iso_date(text) == dateutil_iso_date(text)
+
+
+def test_quick_parse_date_leaves_unknown_formats_to_dateutil():
+    assert quick_parse_date('15 Dec 1993') is None
+    assert quick_parse_date('31/02/2014') is None
+
+
+def test_lru_cache_evicts_least_recently_used():
+    calls = []
+
+    @lru_cache(maxsize=2)
+    def double(n):
+        calls.append(n)
+        return n * 2
+
+    assert [double(1), double(2), double(1), double(3), double(1), double(2)] == [
+        2, 4, 2, 6, 2, 4
+    ]
+    assert calls == [1, 2, 3, 2]
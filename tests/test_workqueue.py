@@ -0,0 +1,192 @@
+import threading
+
+import pytest
+
+from scraper import Scraper, root_url
+from state import StateStore
+from tests.helpers import Clock
+from tests.test_scraper import FixtureFetcher
+from workqueue import SharedRateLimiter, WorkQueue, crawl
+
+
+def company(cno, *categories):
+    return {'cno': cno, 'url': 'http://example.com/%s' % cno, 'categories': list(categories)}
+
+
+def test_work_queue_leases_companies_until_they_are_done(tmpdir):
+    clock = Clock(1000.0)
+    path = str(tmpdir.join('queue.sqlite'))
+    queue = WorkQueue(path, lease=60, clock=clock)
+    assert not queue.ready()
+    queue.enqueue([company('1', 'a'), company('2', 'a'), company('3', 'a')])
+    queue.enqueue([company('1', 'b')])
+    assert queue.ready()
+
+    other = WorkQueue(path, lease=60, clock=clock)
+    lease, companies = queue.claim('one', 2)
+    assert companies == [company('1', 'a', 'b'), company('2', 'a')]
+    assert [c['cno'] for c in other.claim('two', 2)[1]] == ['3']
+    assert other.claim('two', 2)[1] == []
+
+    # Finishing a company keeps the rest of the lease going; the others lapse
+    clock.now += 50
+    queue.complete(lease, '1', {'n': 1})
+    clock.now += 20
+    lease, companies = other.claim('two', 2)
+    assert [c['cno'] for c in companies] == ['3']
+    other.complete(lease, '3', {'n': 3})
+    other.complete(lease, '3', {'n': 'again'})
+    assert queue.unfinished() == 1
+
+    queue.complete(lease, '2', {'n': 2})
+    assert queue.unfinished() == 0
+    assert list(other.records()) == [{'n': 1}, {'n': 2}, {'n': 3}]
+
+    queue.reset()
+    assert not queue.ready()
+    assert list(queue.records()) == []
+
+
+def test_shared_rate_limiter_paces_every_worker_together(tmpdir):
+    clock = Clock(1000.0)
+    path = str(tmpdir.join('queue.sqlite'))
+    workers = [
+        SharedRateLimiter(path, rate=2, clock=clock, sleep=clock.sleep)
+        for n in range(2)
+    ]
+    for worker in workers * 2:
+        worker.wait('http://example.com/page')
+    # Each waits its turn, half a second after the last
+    assert clock.sleeps == [0.5, 0.5, 0.5]
+
+    workers[0].failed('http://example.com/page', retry_after=10)
+    workers[1].wait('http://example.com/page')
+    workers[1].wait('http://example.org/page')
+    assert clock.sleeps[-1] == 10.5
+
+
+def test_crawl_shares_companies_between_workers(tmpdir):
+    path = str(tmpdir.join('queue.sqlite'))
+    fetchers = [FixtureFetcher(), FixtureFetcher()]
+
+    def work():
+        scraper = Scraper(fetchers[1])
+        assert list(crawl(WorkQueue(path), scraper, root_url, 'worker', size=5, poll=0.01)) == []
+
+    worker = threading.Thread(target=work)
+    worker.start()
+    records = list(crawl(
+        WorkQueue(path), Scraper(fetchers[0]), root_url, 'coordinator',
+        coordinate=True, size=5, poll=0.01,
+    ))
+    worker.join()
+
+    assert len(records) == 42
+    assert len(set(data['source_url'] for data in records)) == 42
+    company_pages = [
+        url for fetcher in fetchers for url in fetcher.urls if 'resultc_' in url
+    ]
+    assert len(company_pages) == 42
+    assert not WorkQueue(path).ready()
+
+
+def test_work_queue_parks_companies_that_keep_failing(tmpdir):
+    clock = Clock(1000.0)
+    queue = WorkQueue(str(tmpdir.join('queue.sqlite')), lease=60, max_attempts=2, clock=clock)
+    queue.enqueue([company('1', 'a'), company('2', 'a')])
+
+    for attempt in range(2):
+        lease, companies = queue.claim('worker', 1)
+        assert companies == [company('1', 'a')]
+        clock.now += 61
+    assert queue.unfinished() == 1
+    assert queue.parked() == [company('1', 'a')]
+
+    lease, companies = queue.claim('worker', 1)
+    assert companies == [company('2', 'a')]
+    queue.complete(lease, '2', {'n': 2})
+    assert queue.unfinished() == 0
+
+
+def test_work_queue_retries_a_lapsed_batch_one_company_at_a_time(tmpdir):
+    clock = Clock(1000.0)
+    queue = WorkQueue(str(tmpdir.join('queue.sqlite')), lease=60, clock=clock)
+    queue.enqueue([company(str(n), 'a') for n in range(1, 6)])
+
+    lease, companies = queue.claim('worker', 3)
+    queue.complete(lease, '1', {'n': 1})
+    clock.now += 61
+
+    assert queue.claim('worker', 3)[1] == [company('2', 'a')]
+    assert queue.claim('worker', 3)[1] == [company('3', 'a')]
+    assert queue.claim('worker', 3)[1] == [company('4', 'a'), company('5', 'a')]
+
+
+class BrokenFetcher(FixtureFetcher):
+    """Fails every time on one company's page"""
+
+    def fetch(self, url):
+        if 'cno=0000005026' in url:
+            raise ValueError('unreadable page')
+        return super(BrokenFetcher, self).fetch(url)
+
+
+def test_crawl_gives_up_on_a_company_that_crashes_workers(tmpdir):
+    path = str(tmpdir.join('queue.sqlite'))
+    state = StateStore(str(tmpdir.join('state.sqlite')), autocommit=False)
+    parked = []
+
+    def work():
+        scraper = Scraper(BrokenFetcher(), state=state)
+        return list(crawl(
+            WorkQueue(path, lease=0, max_attempts=2), scraper, root_url, 'coordinator',
+            coordinate=True, size=5, poll=0.01,
+            on_complete=state.commit, on_parked=parked.extend,
+        ))
+
+    for attempt in range(2):
+        with pytest.raises(ValueError):
+            work()
+    # What the crashed workers scraped was saved as they went
+    state.close()
+    state = StateStore(str(tmpdir.join('state.sqlite')), autocommit=False)
+    assert state.record('0000000505') is not None
+
+    # The companies leased along with it are retried, and not given up on
+    records = work()
+    assert len(records) == 41
+    assert [company['cno'] for company in parked] == ['0000005026']
+
+
+def test_shared_rate_limiter_slows_every_worker_when_the_server_struggles(tmpdir):
+    clock = Clock(1000.0)
+    path = str(tmpdir.join('queue.sqlite'))
+    workers = [
+        SharedRateLimiter(path, rate=4, adaptive=True, min_rate=1, max_rate=8,
+                          clock=clock, sleep=clock.sleep)
+        for n in range(2)
+    ]
+    url = 'http://example.com/page'
+    workers[0].wait(url)
+    workers[0].succeeded(url, 0.1)
+    assert workers[1].rate_for(url) == 4.125
+
+    # A 503 without Retry-After cuts the rate once for everyone
+    workers[0].failed(url)
+    workers[1].failed(url)
+    assert workers[1].rate_for(url) == 2.0625
+    clock.now += 2
+    workers[1].failed(url)
+    workers[1].succeeded(url, 10)
+    assert workers[0].rate_for(url) == 1.03125
+
+    # Slots are taken at the new rate
+    workers[0].wait(url)
+    workers[1].wait(url)
+    assert clock.sleeps[-1] == pytest.approx(1 / 1.03125)
+
+    workers[0].failed(url)
+    clock.now += 2
+    workers[0].failed(url)
+    assert workers[1].rate_for(url) == 1
+    assert SharedRateLimiter(path, rate=4, clock=clock).rate_for('http://example.org/') == 4
@@ -1,4 +1,9 @@
+import re
 import string
+import threading
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
 
 from dateutil.parser import parse
 
@@ -18,10 +23,89 @@ def strip_whitespace(obj):
         return obj
 
 
+def element_text(element):
+    """
+    Text of an lxml element and everything inside it, as PyQuery's .text()
+    would give it: each non-blank fragment stripped and joined with spaces.
+    """
+    return ' '.join([t.strip() for t in element.itertext() if t.strip()])
+
+
+def company_id(company_url):
+    """The company's `cno`, from the URL of any of its pages"""
+    m = re.search(r'[?&]cno=(?P<id>\d+)', company_url)
+    if m:
+        return m.group('id')
+
+
+def lru_cache(maxsize=1024):
+    """
+    Remember the results of a one-argument function for its `maxsize` most
+    recently used arguments.
+    """
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(arg):
+            with lock:
+                if arg in cache:
+                    cache[arg] = result = cache.pop(arg)
+                    return result
+            result = func(arg)
+            with lock:
+                cache[arg] = result
+                if len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return result
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+MONTHS = dict(
+    (name, number)
+    for number, names in enumerate([
+        ('jan', 'january'), ('feb', 'february'), ('mar', 'march'),
+        ('apr', 'april'), ('may',), ('jun', 'june'),
+        ('jul', 'july'), ('aug', 'august'), ('sep', 'september'),
+        ('oct', 'october'), ('nov', 'november'), ('dec', 'december'),
+    ], 1)
+    for name in names
+)
+
+NUMERIC_DATE = re.compile(r'\s*(\d{1,2})/(\d{1,2})/(\d{4})\s*$')
+WRITTEN_DATE = re.compile(r'\s*([A-Za-z]+) (\d{1,2}), (\d{4})\s*$')
+
+
+def quick_parse_date(text):
+    """
+    Parse the date formats the SEC pages use (31/01/2014, Dec 15, 1993)
+    without going through dateutil. None for anything else.
+    """
+    m = NUMERIC_DATE.match(text)
+    if m:
+        day, month, year = m.groups()
+    else:
+        m = WRITTEN_DATE.match(text)
+        if not m or m.group(1).lower() not in MONTHS:
+            return None
+        month = MONTHS[m.group(1).lower()]
+        day, year = m.group(2, 3)
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        # Leave dateutil to make what it can of it
+        return None
+
+
 def parse_date(text):
-    return parse(text, dayfirst=True).date()
+    return quick_parse_date(text) or parse(text, dayfirst=True).date()
 
 
+@lru_cache(maxsize=4096)
 def iso_date(text):
     try:
         return parse_date(text).isoformat()
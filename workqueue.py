@@ -0,0 +1,331 @@
+"""
+A crawl shared between several scraper processes, on one machine or many.
+
+One process coordinates: it walks the main index and company indexes and
+queues every company, once per `cno`. Every process, the coordinator too,
+then leases batches of companies from the queue, scrapes them and stores
+their records back in it. A lease that isn't finished in time, say because
+its worker died, lapses and the companies go to another worker. Once every
+company is done, the coordinator writes out all the records, in index order.
+
+The queue is a SQLite database, so it can sit on a volume shared by
+containers or machines, as long as the filesystem's locking works. Requests
+to each host are paced across all the workers by a SharedRateLimiter kept in
+the same database, going by each machine's clock, and slowed down for them
+all when the server struggles.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from urlparse import urlsplit
+
+from utils import company_id
+
+
+def connect(path):
+    # Transactions are begun explicitly, and only as they're needed
+    return sqlite3.connect(path, timeout=60, isolation_level=None,
+                           check_same_thread=False)
+
+
+@contextmanager
+def transaction(db):
+    """Hold the database's write lock for the `with` block"""
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except:
+        db.execute('ROLLBACK')
+        raise
+    db.execute('COMMIT')
+
+
+class WorkQueue(object):
+    """
+    The companies in a shared crawl, who's working on which, and the
+    records of those that are done.
+
+    A lease on a batch of companies lasts `lease` seconds, and is extended
+    each time one of them is done. A company that's been leased
+    `max_attempts` times without being done, say because scraping it
+    crashes the worker, is parked: left out of the crawl rather than
+    crashing every worker in turn.
+    """
+    def __init__(self, path, lease=600, max_attempts=3, clock=time.time):
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self._db = connect(path)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS companies (
+                cno TEXT PRIMARY KEY,
+                company TEXT NOT NULL,
+                lease TEXT,
+                expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                record TEXT
+            );
+            CREATE TABLE IF NOT EXISTS crawl (
+                ready INTEGER NOT NULL
+            );
+        ''')
+
+    def ready(self):
+        """Whether the coordinator has queued the crawl's companies"""
+        return self._db.execute('SELECT ready FROM crawl').fetchone() is not None
+
+    def enqueue(self, companies):
+        """
+        Queue companies for the crawl, then open it to workers. A company
+        that's already queued gains any new categories.
+        """
+        with transaction(self._db):
+            for company in companies:
+                row = self._db.execute(
+                    'SELECT company FROM companies WHERE cno = ?', (company['cno'],)
+                ).fetchone()
+                if row:
+                    queued = json.loads(row[0])
+                    for category in company['categories']:
+                        if category not in queued['categories']:
+                            queued['categories'].append(category)
+                    self._db.execute(
+                        'UPDATE companies SET company = ? WHERE cno = ?',
+                        (json.dumps(queued), company['cno'])
+                    )
+                else:
+                    self._db.execute(
+                        'INSERT INTO companies (cno, company) VALUES (?, ?)',
+                        (company['cno'], json.dumps(company))
+                    )
+            self._db.execute('DELETE FROM crawl')
+            self._db.execute('INSERT INTO crawl VALUES (1)')
+
+    def claim(self, worker, size):
+        """
+        Lease up to `size` companies that aren't done, leased or parked, in
+        the order they were queued. Gives the lease and the companies.
+
+        A company from a batch whose lease lapsed is leased on its own, so
+        that only the one that keeps failing uses up its attempts, not the
+        companies queued after it.
+        """
+        now = self._clock()
+        lease = '%s/%s' % (worker, uuid.uuid4().hex)
+        with transaction(self._db):
+            rows = self._db.execute('''
+                SELECT cno, attempts FROM companies
+                WHERE record IS NULL AND attempts < ?
+                    AND (expires IS NULL OR expires < ?)
+                ORDER BY rowid LIMIT ?
+            ''', (self.max_attempts, now, size)).fetchall()
+            if rows and rows[0][1]:
+                cnos = [rows[0][0]]
+            else:
+                cnos = []
+                for cno, attempts in rows:
+                    if attempts:
+                        break
+                    cnos.append(cno)
+            self._db.executemany('''
+                UPDATE companies SET lease = ?, expires = ?, attempts = attempts + 1
+                WHERE cno = ?
+            ''', [(lease, now + self.lease, cno) for cno in cnos])
+            companies = [
+                json.loads(company) for (company,) in self._db.execute(
+                    'SELECT company FROM companies WHERE lease = ? ORDER BY rowid',
+                    (lease,)
+                )
+            ]
+        return lease, companies
+
+    def complete(self, lease, cno, record):
+        """
+        Store a company's record, unless another worker got there first,
+        and extend the lease on the rest of its batch.
+        """
+        with transaction(self._db):
+            self._db.execute(
+                'UPDATE companies SET record = ? WHERE cno = ? AND record IS NULL',
+                (json.dumps(record), cno)
+            )
+            self._db.execute(
+                'UPDATE companies SET expires = ? WHERE lease = ? AND record IS NULL',
+                (self._clock() + self.lease, lease)
+            )
+
+    def unfinished(self):
+        """How many companies aren't done yet, leaving out those parked"""
+        return self._db.execute('''
+            SELECT COUNT(*) FROM companies
+            WHERE record IS NULL AND (attempts < ? OR expires >= ?)
+        ''', (self.max_attempts, self._clock())).fetchone()[0]
+
+    def parked(self):
+        """The companies given up on after `max_attempts` leases"""
+        return [
+            json.loads(company) for (company,) in self._db.execute('''
+                SELECT company FROM companies
+                WHERE record IS NULL AND attempts >= ? AND expires < ?
+                ORDER BY rowid
+            ''', (self.max_attempts, self._clock()))
+        ]
+
+    def records(self):
+        """Every company's record, in the order the companies were queued"""
+        for (record,) in self._db.execute(
+            'SELECT record FROM companies WHERE record IS NOT NULL ORDER BY rowid'
+        ):
+            yield json.loads(record)
+
+    def reset(self):
+        """Clear the queue, for the next crawl"""
+        with transaction(self._db):
+            self._db.execute('DELETE FROM companies')
+            self._db.execute('DELETE FROM crawl')
+
+    def close(self):
+        self._db.close()
+
+
+class SharedRateLimiter(object):
+    """
+    Paces requests to each host at `rate` a second between every process
+    using the queue at `path`: each request takes the next free slot.
+
+    With `adaptive`, the shared rate follows how well the server copes, as
+    an AdaptiveTokenBucket's does: it creeps up by `increase` while
+    responses come back within `slow` seconds, up to `max_rate`, and is cut
+    by `decrease` when one is slower or a request fails, down to
+    `min_rate`, at most once every `cooldown` seconds. So every worker backs
+    off together. A Retry-After from the server holds back every worker.
+    """
+    def __init__(self, path, rate, adaptive=False, min_rate=0.25, max_rate=8.0,
+                 increase=0.5, decrease=0.5, slow=5.0, cooldown=2.0,
+                 clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.adaptive = adaptive
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.slow = slow
+        self.cooldown = cooldown
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._db = connect(path)
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS slots (
+                host TEXT PRIMARY KEY,
+                next REAL NOT NULL,
+                rate REAL NOT NULL,
+                backed_off REAL
+            )
+        ''')
+
+    @contextmanager
+    def _slot(self, host):
+        """The host's next slot, rate and last back-off, saved after the `with` block"""
+        with self._lock, transaction(self._db):
+            row = self._db.execute(
+                'SELECT next, rate, backed_off FROM slots WHERE host = ?', (host,)
+            ).fetchone()
+            slot = list(row) if row else [self._clock(), self.rate, None]
+            yield slot
+            self._db.execute(
+                'INSERT OR REPLACE INTO slots VALUES (?, ?, ?, ?)', [host] + slot
+            )
+
+    def _take(self, host, earliest=None):
+        with self._slot(host) as slot:
+            now = self._clock()
+            start = max(now, earliest or now, slot[0])
+            slot[0] = start + 1.0 / slot[1]
+        return start - now
+
+    def _adjust(self, host, back_off):
+        with self._slot(host) as slot:
+            now = self._clock()
+            if back_off:
+                if slot[2] is not None and now - slot[2] < self.cooldown:
+                    return
+                slot[1] *= self.decrease
+                slot[2] = now
+            else:
+                slot[1] += self.increase / slot[1]
+            slot[1] = min(self.max_rate, max(self.min_rate, slot[1]))
+
+    def rate_for(self, url):
+        """The rate requests to the URL's host are paced at now"""
+        row = self._db.execute(
+            'SELECT rate FROM slots WHERE host = ?', (urlsplit(url).netloc,)
+        ).fetchone()
+        return row[0] if row else self.rate
+
+    def wait(self, url):
+        delay = self._take(urlsplit(url).netloc)
+        if delay > 0:
+            self._sleep(delay)
+
+    def succeeded(self, url, seconds):
+        if self.adaptive:
+            self._adjust(urlsplit(url).netloc, seconds > self.slow)
+
+    def failed(self, url, retry_after=None):
+        if self.adaptive:
+            self._adjust(urlsplit(url).netloc, True)
+        if retry_after:
+            self._take(urlsplit(url).netloc, self._clock() + retry_after)
+
+    def close(self):
+        self._db.close()
+
+
+def crawl(queue, scraper, url, worker, coordinate=False, size=20, poll=5.0,
+          sleep=time.sleep, on_complete=None, on_parked=None):
+    """
+    Take part in a crawl shared through `queue`, scraping leased batches of
+    `size` companies with `scraper` until every company is done.
+
+    The coordinator first queues the companies from `url`, unless an
+    unfinished crawl is queued already, and at the end yields every record
+    and clears the queue. Other workers wait for it to queue the companies,
+    and yield nothing.
+
+    `on_complete` is called before each record goes back to the queue, say
+    to save the scraper's state, and the coordinator passes any companies
+    the queue gave up on to `on_parked`.
+    """
+    if coordinate and not queue.ready():
+        queue.enqueue(scraper.find_companies(scraper.company_indexes(url)).values())
+    while not queue.ready():
+        sleep(poll)
+
+    while True:
+        lease, companies = queue.claim(worker, size)
+        if not companies:
+            if not queue.unfinished():
+                break
+            # Wait for other workers to finish, or their leases to lapse
+            sleep(poll)
+            continue
+
+        # The queue sees that each company is scraped once; one that comes
+        # back to this worker after its lease lapsed is scraped again
+        scraper.processed.clear()
+        for data in scraper.scrape_companies(companies):
+            if on_complete:
+                on_complete()
+            queue.complete(lease, company_id(data['source_url']) or data['source_url'], data)
+
+    if coordinate:
+        parked = queue.parked()
+        if parked and on_parked:
+            on_parked(parked)
+        for data in queue.records():
+            yield data
+        queue.reset()